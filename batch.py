@@ -0,0 +1,203 @@
+"""
+Convert many positions to NumPy arrays at once and evaluate them with vectorized operations.
+
+Positions are represented as an (N, 12) uint64 array with one bitboard per piece code (see
+Board.bitboards), built from Boards or from packed positions (Board.pack, PositionDatabase)
+without Python code per square. Material, piece-square and mobility scores are computed for the
+whole array at once, so throughput grows with the batch size instead of the number of objects.
+
+    bitboards = batch.from_packed(batch.load('positions.bin'))
+    scores = batch.evaluate(bitboards)
+
+NumPy is an optional dependency, only this module needs it.
+"""
+import chess
+import positions
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+CHUNK = 1 << 16
+
+if np is not None:
+    PACKED_DTYPE = np.dtype([('occupied', '<u8'), ('codes_low', '<u8'), ('codes_high', '<u8'),
+                             ('flags', 'u1'), ('ep', 'u1'), ('halfmove', 'u1'), ('fullmove', '<u2'),
+                             ('padding', 'V3')])
+    POPCOUNT_8 = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+    PIECE_CODES = np.arange(12, dtype=np.uint8)
+    MG_TABLE = np.array(chess.MG_TABLE, dtype=np.int64)
+    EG_TABLE = np.array(chess.EG_TABLE, dtype=np.int64)
+    PHASE_TABLE = np.array(chess.PHASE_TABLE, dtype=np.int64)
+
+    BB_ALL = np.uint64(chess.BB_ALL)
+    NOT_FILE_A = np.uint64(~chess.BB_FILE_A & chess.BB_ALL)
+    NOT_FILE_H = np.uint64(~chess.BB_FILE_H & chess.BB_ALL)
+    NOT_FILE_AB = np.uint64(~(chess.BB_FILE_A | chess.BB_FILE_A << 1) & chess.BB_ALL)
+    NOT_FILE_GH = np.uint64(~(chess.BB_FILE_H | chess.BB_FILE_H >> 1) & chess.BB_ALL)
+    # shift and mask of the target squares of the eight ray directions
+    ROOK_RAYS = [(8, BB_ALL), (-8, BB_ALL), (1, NOT_FILE_A), (-1, NOT_FILE_H)]
+    BISHOP_RAYS = [(9, NOT_FILE_A), (7, NOT_FILE_H), (-7, NOT_FILE_A), (-9, NOT_FILE_H)]
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("batch operations require the numpy package")
+
+
+def from_boards(boards):
+    """(N, 12) uint64 array of the piece bitboards of boards"""
+    _require_numpy()
+    return np.array([board.bitboards for board in boards], dtype=np.uint64).reshape(-1, 12)
+
+
+def records(data):
+    """
+    structured array of packed positions, data is a bytes-like object of concatenated records,
+    e.g. b''.join(board.pack() for board in boards), or an array returned by load
+    """
+    _require_numpy()
+    if isinstance(data, np.ndarray) and data.dtype == PACKED_DTYPE:
+        return data
+    return np.frombuffer(data, dtype=PACKED_DTYPE)
+
+
+def load(database):
+    """memory mapped structured array of the positions of a PositionDatabase or its file name"""
+    _require_numpy()
+    if isinstance(database, positions.PositionDatabase):
+        database.flush()
+        path, count = database.path, len(database)
+    else:
+        with positions.PositionDatabase(database, writable=False) as opened:
+            path, count = database, len(opened)
+    if not count:
+        return np.zeros(0, dtype=PACKED_DTYPE)
+    return np.memmap(path, dtype=PACKED_DTYPE, mode='r', offset=positions.HEADER.size, shape=(count,))
+
+
+def turns(data):
+    """(N,) array of the side to move (0 white, 1 black) of packed positions"""
+    return records(data)['flags'] & 1
+
+
+def _unpack_chunk(packed):
+    count = len(packed)
+    occupied = np.ascontiguousarray(packed['occupied']).view(np.uint8).reshape(count, 8)
+    bits = np.unpackbits(occupied, axis=1, bitorder='little').astype(bool)
+    nibble_bytes = np.empty((count, 16), dtype=np.uint8)
+    nibble_bytes[:, :8] = np.ascontiguousarray(packed['codes_low']).view(np.uint8).reshape(count, 8)
+    nibble_bytes[:, 8:] = np.ascontiguousarray(packed['codes_high']).view(np.uint8).reshape(count, 8)
+    nibbles = np.empty((count, 32), dtype=np.uint8)
+    nibbles[:, 0::2] = nibble_bytes & 15
+    nibbles[:, 1::2] = nibble_bytes >> 4
+    # the k-th occupied square of a position holds the k-th piece code
+    index = np.clip(np.cumsum(bits, axis=1) - 1, 0, 31)
+    codes = np.where(bits, np.take_along_axis(nibbles, index, axis=1), 12)
+    planes = codes[:, None, :] == PIECE_CODES[None, :, None]
+    return np.packbits(planes, axis=2, bitorder='little').view('<u8').reshape(count, 12)
+
+
+def from_packed(data):
+    """(N, 12) uint64 array of the piece bitboards of packed positions"""
+    packed = records(data)
+    bitboards = np.empty((len(packed), 12), dtype=np.uint64)
+    for start in range(0, len(packed), CHUNK):
+        bitboards[start:start + CHUNK] = _unpack_chunk(packed[start:start + CHUNK])
+    return bitboards
+
+
+def to_planes(bitboards):
+    """(N, 12, 8, 8) uint8 array with a 1 for every piece, indexed by piece code, rank and file"""
+    _require_numpy()
+    bitboards = np.ascontiguousarray(bitboards, dtype='<u8')
+    return np.unpackbits(bitboards.view(np.uint8), axis=-1, bitorder='little').reshape(-1, 12, 8, 8)
+
+
+def popcount(bitboards):
+    """number of set bits of every element of a uint64 array"""
+    _require_numpy()
+    bitboards = np.ascontiguousarray(bitboards, dtype='<u8')
+    return POPCOUNT_8[bitboards.view(np.uint8)].reshape(bitboards.shape + (8,)).sum(axis=-1, dtype=np.int64)
+
+
+def material(bitboards, values=chess.MG_VALUES):
+    """(N,) material balance from white's point of view, values are indexed by piece type"""
+    _require_numpy()
+    weights = np.array(list(values) + [-value for value in values], dtype=np.int64)
+    return popcount(bitboards) @ weights
+
+
+def evaluate(bitboards, turns=None):
+    """
+    (N,) tapered material and piece-square scores, equal to Board.evaluate. Scores are from
+    white's point of view, or from the side to move's if an array of turns is given.
+    """
+    _require_numpy()
+    bitboards = np.asarray(bitboards, dtype=np.uint64)
+    scores = np.empty(len(bitboards), dtype=np.int64)
+    total = chess.PHASE_TOTAL
+    for start in range(0, len(bitboards), CHUNK):
+        chunk = bitboards[start:start + CHUNK]
+        planes = to_planes(chunk).reshape(-1, 12, 64)
+        mg = np.einsum('npq,pq->n', planes, MG_TABLE)
+        eg = np.einsum('npq,pq->n', planes, EG_TABLE)
+        phase = np.minimum(popcount(chunk) @ PHASE_TABLE, total)
+        scores[start:start + CHUNK] = (mg * phase + eg * (total - phase)) // total
+    if turns is not None:
+        scores = np.where(np.asarray(turns) == 1, -scores, scores)
+    return scores
+
+
+def _shift(bitboards, amount):
+    if amount > 0:
+        return bitboards << np.uint64(amount)
+    return bitboards >> np.uint64(-amount)
+
+
+def _ray_attacks(sliders, empty, amount, mask):
+    """squares attacked along one direction by every slider, with a Kogge-Stone fill"""
+    propagate = empty & mask
+    sliders = sliders | (propagate & _shift(sliders, amount))
+    propagate = propagate & _shift(propagate, amount)
+    sliders = sliders | (propagate & _shift(sliders, 2 * amount))
+    propagate = propagate & _shift(propagate, 2 * amount)
+    sliders = sliders | (propagate & _shift(sliders, 4 * amount))
+    return _shift(sliders, amount) & mask
+
+
+def _knight_attacks(knights):
+    one = ((knights >> np.uint64(1)) & NOT_FILE_H) | ((knights << np.uint64(1)) & NOT_FILE_A)
+    two = ((knights >> np.uint64(2)) & NOT_FILE_GH) | ((knights << np.uint64(2)) & NOT_FILE_AB)
+    return (one << np.uint64(16)) | (one >> np.uint64(16)) | (two << np.uint64(8)) | (two >> np.uint64(8))
+
+
+def attacks(bitboards, color):
+    """(N,) uint64 squares attacked by the knights, bishops, rooks and queens of color index"""
+    _require_numpy()
+    bitboards = np.asarray(bitboards, dtype=np.uint64)
+    base = color * 6
+    empty = ~np.bitwise_or.reduce(bitboards, axis=1)
+    queens = bitboards[:, base + 4]
+    diagonal = bitboards[:, base + 2] | queens
+    straight = bitboards[:, base + 3] | queens
+    attacked = _knight_attacks(bitboards[:, base + 1])
+    for amount, mask in BISHOP_RAYS:
+        attacked |= _ray_attacks(diagonal, empty, amount, mask)
+    for amount, mask in ROOK_RAYS:
+        attacked |= _ray_attacks(straight, empty, amount, mask)
+    return attacked
+
+
+def mobility(bitboards):
+    """
+    (N,) mobility from white's point of view: the number of squares attacked by white knights,
+    bishops, rooks and queens that are not occupied by white pieces, minus the same for black
+    """
+    _require_numpy()
+    bitboards = np.asarray(bitboards, dtype=np.uint64)
+    white = np.bitwise_or.reduce(bitboards[:, :6], axis=1)
+    black = np.bitwise_or.reduce(bitboards[:, 6:], axis=1)
+    return popcount(attacks(bitboards, 0) & ~white) - popcount(attacks(bitboards, 1) & ~black)
@@ -1,4 +1,9 @@
+from array import array
+import gzip
 import itertools
+import random
+import struct
+import sys
 
 
 EMPTYCELL = "."
@@ -11,42 +16,1140 @@ QUEEN = "Q"
 WHITE = "W"
 BLACK = "B"
 
+# Pieces are stored on the board as integer codes 0..11: color * 6 + piece type,
+# with the piece type index taken from PIECE_TYPES and the color index from COLORS.
+PIECE_TYPES = [PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING]
+COLORS = [WHITE, BLACK]
+TYPE_IDX = dict(zip(PIECE_TYPES, range(len(PIECE_TYPES))))
+COLOR_IDX = dict(zip(COLORS, range(len(COLORS))))
+NO_PIECE = -1
+PROMOTION_IDX = {'n': TYPE_IDX[KNIGHT], 'b': TYPE_IDX[BISHOP], 'r': TYPE_IDX[ROOK], 'q': TYPE_IDX[QUEEN]}
+
+# Squares are integers 0..63 with a1 = 0, b1 = 1, ..., h8 = 63.
+FILES = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
+RANKS = [1, 2, 3, 4, 5, 6, 7, 8]
+FILE_IDX = dict(zip(FILES, range(len(FILES))))
+SQUARE_POSITIONS = [(file, rank) for rank in RANKS for file in FILES]
+SQUARE_IDX = dict(zip(SQUARE_POSITIONS, range(64)))
+
+BB_EMPTY = 0
+BB_ALL = (1 << 64) - 1
+BB_SQUARES = [1 << sq for sq in range(64)]
+BB_RANKS = [0xFF << (8 * rank) for rank in range(8)]
+BB_FILES = [0x0101010101010101 << file_idx for file_idx in range(8)]
+
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+FEN_SYMBOLS = 'PNBRQKpnbrqk'
+FEN_CODES = dict(zip(FEN_SYMBOLS, range(12)))
+SAN_PIECES = {'N': 1, 'B': 2, 'R': 3, 'Q': 4, 'K': 5}
+
+# Packed positions: occupancy bitboard, the 4 bit piece codes of the occupied squares from a1
+# to h8 in two 64 bit words, side to move | castling rights << 1, en passant square + 1 (0 if
+# none), halfmove clock, fullmove number and padding to 32 bytes.
+PACKED_FORMAT = struct.Struct('<QQQBBBH3x')
+PACKED_SIZE = PACKED_FORMAT.size
+
+# Castling rights are a 4 bit mask. Moving a piece from or to one of the squares below
+# takes away the corresponding rights.
+CASTLE_WHITE_KING = 1
+CASTLE_WHITE_QUEEN = 2
+CASTLE_BLACK_KING = 4
+CASTLE_BLACK_QUEEN = 8
+CASTLE_ALL = 15
+CASTLING_SYMBOLS = [('K', CASTLE_WHITE_KING), ('Q', CASTLE_WHITE_QUEEN),
+                    ('k', CASTLE_BLACK_KING), ('q', CASTLE_BLACK_QUEEN)]
+CASTLING_CODES = dict(CASTLING_SYMBOLS)
+CASTLING_MASKS = [CASTLE_ALL] * 64
+CASTLING_MASKS[0] = CASTLE_ALL & ~CASTLE_WHITE_QUEEN
+CASTLING_MASKS[7] = CASTLE_ALL & ~CASTLE_WHITE_KING
+CASTLING_MASKS[4] = CASTLE_ALL & ~(CASTLE_WHITE_KING | CASTLE_WHITE_QUEEN)
+CASTLING_MASKS[56] = CASTLE_ALL & ~CASTLE_BLACK_QUEEN
+CASTLING_MASKS[63] = CASTLE_ALL & ~CASTLE_BLACK_KING
+CASTLING_MASKS[60] = CASTLE_ALL & ~(CASTLE_BLACK_KING | CASTLE_BLACK_QUEEN)
+# rook (from, to) squares of a castling move, keyed by the king's destination square
+CASTLING_ROOK_MOVES = {6: (7, 5), 2: (0, 3), 62: (63, 61), 58: (56, 59)}
+
+
+def square(file, rank):
+    """return integer square index of position given in algebraic notation"""
+    sq = SQUARE_IDX.get((file, rank))
+    if sq is None:
+        raise ValueError("Invalid board position %s %d" % (file, rank))
+    return sq
+
+
+def square_name(sq):
+    """return algebraic name of integer square, e.g. 'e4'"""
+    file, rank = SQUARE_POSITIONS[sq]
+    return "%s%d" % (file, rank)
+
+
+def encode_move(from_sq, to_sq, promotion=0):
+    """
+    encode a move as integer: from square in bits 0-5, to square in bits 6-11 and the
+    piece type index (see PIECE_TYPES) of a promotion in bits 12-14, 0 if no promotion
+    """
+    return from_sq | to_sq << 6 | promotion << 12
+
+
+def move_from_uci(uci):
+    """parse move in UCI notation, e.g. 'e2e4' or 'e7e8q'"""
+    try:
+        from_sq = square(uci[0], int(uci[1]))
+        to_sq = square(uci[2], int(uci[3]))
+        promotion = PROMOTION_IDX[uci[4]] if len(uci) == 5 else 0
+    except (IndexError, KeyError, ValueError):
+        raise ValueError("Invalid move %s" % uci)
+    if len(uci) > 5:
+        raise ValueError("Invalid move %s" % uci)
+    return encode_move(from_sq, to_sq, promotion)
+
+
+def move_to_uci(move):
+    """return move in UCI notation"""
+    uci = square_name(move & 63) + square_name(move >> 6 & 63)
+    if move >> 12:
+        uci += PIECE_TYPES[move >> 12].lower()
+    return uci
+
+
+def bb_positions(bb):
+    """return set of (file, rank) tuples of all squares in bitboard bb"""
+    positions = set()
+    while bb:
+        lsb = bb & -bb
+        positions.add(SQUARE_POSITIONS[lsb.bit_length() - 1])
+        bb ^= lsb
+    return positions
+
+
+def _step_targets(sq, offsets):
+    """bitboard of squares one (file, rank) offset away from sq"""
+    targets = BB_EMPTY
+    file, rank = sq & 7, sq >> 3
+    for file_move, rank_move in offsets:
+        target_file, target_rank = file + file_move, rank + rank_move
+        if 0 <= target_file < 8 and 0 <= target_rank < 8:
+            targets |= BB_SQUARES[target_rank * 8 + target_file]
+    return targets
+
+
+def _slide_targets(sq, occupied, directions):
+    """bitboard of squares attacked from sq along directions, up to and including the first blocker"""
+    targets = BB_EMPTY
+    file, rank = sq & 7, sq >> 3
+    for file_move, rank_move in directions:
+        target_file, target_rank = file + file_move, rank + rank_move
+        while 0 <= target_file < 8 and 0 <= target_rank < 8:
+            bb = BB_SQUARES[target_rank * 8 + target_file]
+            targets |= bb
+            if occupied & bb:
+                break
+            target_file += file_move
+            target_rank += rank_move
+    return targets
+
+
+def _subsets(mask):
+    """enumerate all subsets of bitboard mask (carry-rippler)"""
+    subset = BB_EMPTY
+    while True:
+        yield subset
+        subset = (subset - mask) & mask
+        if not subset:
+            return
+
+
+def _relevant_mask(sq, directions):
+    """squares along directions whose occupancy can block a slider on sq"""
+    mask = BB_EMPTY
+    for file_move, rank_move in directions:
+        ray = _slide_targets(sq, BB_EMPTY, [(file_move, rank_move)])
+        # the square at the end of a ray never shadows anything behind it
+        if rank_move * 8 + file_move > 0:
+            ray &= ~(1 << (ray.bit_length() - 1)) if ray else BB_EMPTY
+        else:
+            ray &= ray - 1
+        mask |= ray
+    return mask
+
+
+def _slider_tables(lines):
+    """
+    build relevant occupancy masks and occupancy -> attacks tables for a slider moving along lines,
+    each line being a pair of opposite directions. The full table of every square is assembled from
+    the much smaller per-line tables, which keeps the work done at import time low.
+    """
+    masks, tables = [], []
+    for sq in range(64):
+        line_masks = [_relevant_mask(sq, directions) for directions in lines]
+        line_tables = [dict((subset, _slide_targets(sq, subset, directions)) for subset in _subsets(line_mask))
+                       for directions, line_mask in zip(lines, line_masks)]
+        (mask_1, mask_2), (table_1, table_2) = line_masks, line_tables
+        mask = mask_1 | mask_2
+        masks.append(mask)
+        tables.append(dict((subset, table_1[subset & mask_1] | table_2[subset & mask_2])
+                           for subset in _subsets(mask)))
+    return masks, tables
+
+
+ROOK_DIRECTIONS = [(0, -1), (0, 1), (1, 0), (-1, 0)]
+BISHOP_DIRECTIONS = [(-1, -1), (1, 1), (-1, 1), (1, -1)]
+KNIGHT_OFFSETS = [(1, -2), (1, 2), (-1, -2), (-1, 2), (2, -1), (2, 1), (-2, 1), (-2, -1)]
+KING_OFFSETS = [(1, -1), (1, 0), (1, 1), (0, -1), (0, 1), (-1, -1), (-1, 0), (-1, 1)]
+
+# Attack tables, computed once at import time. Sliding pieces look up their attacks by the
+# occupancy of the squares that can block them (the idea behind magic/PEXT bitboards); in
+# Python a dict keyed by the masked occupancy is faster than a magic multiply and shift.
+KNIGHT_ATTACKS = [_step_targets(sq, KNIGHT_OFFSETS) for sq in range(64)]
+KING_ATTACKS = [_step_targets(sq, KING_OFFSETS) for sq in range(64)]
+PAWN_ATTACKS = [[_step_targets(sq, [(-1, 1), (1, 1)]) for sq in range(64)],
+                [_step_targets(sq, [(-1, -1), (1, -1)]) for sq in range(64)]]
+ROOK_MASKS, ROOK_TABLES = _slider_tables([ROOK_DIRECTIONS[:2], ROOK_DIRECTIONS[2:]])
+BISHOP_MASKS, BISHOP_TABLES = _slider_tables([BISHOP_DIRECTIONS[:2], BISHOP_DIRECTIONS[2:]])
+
+
+def rook_attacks(sq, occupied):
+    """bitboard of squares attacked by a rook on sq given the board occupancy"""
+    return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]]
+
+
+def bishop_attacks(sq, occupied):
+    """bitboard of squares attacked by a bishop on sq given the board occupancy"""
+    return BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+
+
+def queen_attacks(sq, occupied):
+    """bitboard of squares attacked by a queen on sq given the board occupancy"""
+    return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]] | BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+
+
+def _between(sq_1, sq_2):
+    """bitboard of squares strictly between two squares on a common rank, file or diagonal"""
+    file_move = (sq_2 & 7) - (sq_1 & 7)
+    rank_move = (sq_2 >> 3) - (sq_1 >> 3)
+    if sq_1 == sq_2 or not (file_move == 0 or rank_move == 0 or abs(file_move) == abs(rank_move)):
+        return BB_EMPTY
+    file_move = (file_move > 0) - (file_move < 0)
+    rank_move = (rank_move > 0) - (rank_move < 0)
+    return _slide_targets(sq_1, BB_SQUARES[sq_2], [(file_move, rank_move)]) & ~BB_SQUARES[sq_2]
+
+
+BB_BETWEEN = [[_between(sq_1, sq_2) for sq_2 in range(64)] for sq_1 in range(64)]
+BB_FILE_A = 0x0101010101010101
+BB_FILE_H = BB_FILE_A << 7
+
+
+def piece_attacks(piece_type, sq, occupied):
+    """bitboard of squares attacked by a knight, bishop, rook, queen or king (type index) on sq"""
+    if piece_type == 1:
+        return KNIGHT_ATTACKS[sq]
+    if piece_type == 2:
+        return BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+    if piece_type == 3:
+        return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]]
+    if piece_type == 4:
+        return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]] | BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+    return KING_ATTACKS[sq]
+
+
+def _append_pawn_move(append, from_sq, to_sq, promotes):
+    """append pawn move, expanded into the four promotions if it reaches the last rank"""
+    move = from_sq | to_sq << 6
+    if promotes:
+        for promotion in (4, 3, 2, 1):
+            append(move | promotion << 12)
+    else:
+        append(move)
+
+
+# Zobrist hashing: one random 64-bit number per piece code and square, castling rights mask,
+# en passant file and side to move. A fixed seed keeps keys stable across processes.
+_zobrist_random = random.Random(0x2BD1F5C3)
+ZOBRIST_PIECES = [[_zobrist_random.getrandbits(64) for sq in range(64)] for code in range(12)]
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for rights in range(16)]
+ZOBRIST_CASTLING[0] = 0
+ZOBRIST_EP = dict((sq, _zobrist_random.getrandbits(64)) for sq in range(64))
+ZOBRIST_EP[None] = 0
+ZOBRIST_TURN = [0, _zobrist_random.getrandbits(64)]
+
+# Evaluation: material and piece-square tables for the middlegame and the endgame, blended by
+# the game phase (24 with all minor and major pieces on the board, 0 with only kings and pawns).
+# Tables are written from white's point of view with rank 8 on top.
+MG_VALUES = [82, 337, 365, 477, 1025, 0]
+EG_VALUES = [94, 281, 297, 512, 936, 0]
+PHASE_WEIGHTS = [0, 1, 1, 2, 4, 0]
+PHASE_TOTAL = 24
+
+_PAWN_MG = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0]
+_PAWN_EG = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     15,  15,  15,  15,  15,  15,  15,  15,
+      5,   5,   5,   5,   5,   5,   5,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+      0,   0,   0,   0,   0,   0,   0,   0]
+_KNIGHT = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+_BISHOP = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+_ROOK = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0]
+_QUEEN = [
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20]
+_KING_MG = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20]
+_KING_EG = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+
+
+def _score_tables(values, tables):
+    """
+    combine material values and piece-square tables into per piece code and square scores from
+    white's point of view, black pieces score negative on the vertically mirrored square
+    """
+    white = [[value + table[sq ^ 56] for sq in range(64)] for value, table in zip(values, tables)]
+    black = [[-value - table[sq] for sq in range(64)] for value, table in zip(values, tables)]
+    return white + black
+
+
+MG_TABLE = _score_tables(MG_VALUES, [_PAWN_MG, _KNIGHT, _BISHOP, _ROOK, _QUEEN, _KING_MG])
+EG_TABLE = _score_tables(EG_VALUES, [_PAWN_EG, _KNIGHT, _BISHOP, _ROOK, _QUEEN, _KING_EG])
+PHASE_TABLE = PHASE_WEIGHTS + PHASE_WEIGHTS
+
 class Board(object):
     """
     Class representing a chess board and position of all pieces using standard algebraic notation
     https://en.wikipedia.org/wiki/Algebraic_notation_(chess)
+
+    Internally the position is kept as one 64-bit integer (bitboard) per piece type and color,
+    occupancy masks per color and a 64 entry mailbox of piece codes indexed by integer square.
+    The side to move is stored as color index in turn (0 white, 1 black).
     """
 
+    __slots__ = ('bitboards', 'occupied_co', 'occupied', 'mailbox', '_piece_key', '_attack_cache',
+                 '_mg', '_eg', '_phase', 'turn', 'castling_rights', 'ep_square', 'halfmove_clock',
+                 'fullmove_number', '_stack')
+
+    # lookup tables shared by all boards
+    ranks = RANKS
+    files = FILES
+    file_idx = FILE_IDX
+
     def __init__(self):
-        self.ranks = [1, 2, 3, 4, 5, 6, 7, 8]
-        self.files = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
-        self.file_idx = dict(zip(self.files, range(len(self.files))))
-        self.board = [[EMPTYCELL]*8 for _ in range(8)] 
-        self.pieces = set()
+        self.clear_board()
+
+    def copy(self, stack=True):
+        """
+        independent copy of the position, made by copying the flat arrays of the board. Without
+        stack the copy has no move history, so its moves cannot be taken back beyond the position.
+        """
+        board = type(self).__new__(type(self))
+        board.bitboards = self.bitboards[:]
+        board.occupied_co = self.occupied_co[:]
+        board.occupied = self.occupied
+        board.mailbox = self.mailbox[:]
+        board._piece_key = self._piece_key
+        # cached attack info is never modified, only replaced, so it can be shared
+        board._attack_cache = self._attack_cache[:]
+        board._mg = self._mg
+        board._eg = self._eg
+        board._phase = self._phase
+        board.turn = self.turn
+        board.castling_rights = self.castling_rights
+        board.ep_square = self.ep_square
+        board.halfmove_clock = self.halfmove_clock
+        board.fullmove_number = self.fullmove_number
+        board._stack = self._stack[:] if stack else []
+        return board
 
     def file_to_idx(self, file):
         return self.file_idx[file]
 
     def get_piece_at_position(self, file, rank):
         """return piece at specified position or EMPTYCELL if cell is empty"""
-        if file not in self.files or rank not in self.ranks:
-            raise ValueError("Invalid board position %s %d" % (file, rank))
-        return self.board[self.file_to_idx(file)][rank-1]
+        return self.piece_at(square(file, rank))
+
+    def piece_at(self, sq):
+        """return piece at integer square or EMPTYCELL if cell is empty"""
+        code = self.mailbox[sq]
+        if code == NO_PIECE:
+            return EMPTYCELL
+        file, rank = SQUARE_POSITIONS[sq]
+        return PIECE_CLASSES[code % 6](file, rank, COLORS[code // 6], self)
 
     def set_piece(self, piece):
         """set piece at specified position"""
-        self.board[self.file_to_idx(piece.file)][piece.rank-1] = piece
-        self.pieces.add(piece)
+        self._put(piece.square, piece.index)
 
     def is_empty(self, file, rank):
         """helper function to check if cell is empty"""
-        return self.get_piece_at_position(file, rank) == EMPTYCELL
+        return not self.occupied & BB_SQUARES[square(file, rank)]
+
+    def _put(self, sq, code):
+        """place piece code on square, replacing whatever stood there"""
+        if self.mailbox[sq] != NO_PIECE:
+            self._remove(sq)
+        bb = BB_SQUARES[sq]
+        self.mailbox[sq] = code
+        self.bitboards[code] |= bb
+        self.occupied_co[code // 6] |= bb
+        self.occupied |= bb
+        self._piece_key ^= ZOBRIST_PIECES[code][sq]
+        self._mg += MG_TABLE[code][sq]
+        self._eg += EG_TABLE[code][sq]
+        self._phase += PHASE_TABLE[code]
+
+    def _remove(self, sq):
+        """remove piece from square and return its code"""
+        code = self.mailbox[sq]
+        mask = ~BB_SQUARES[sq]
+        self.mailbox[sq] = NO_PIECE
+        self.bitboards[code] &= mask
+        self.occupied_co[code // 6] &= mask
+        self.occupied &= mask
+        self._piece_key ^= ZOBRIST_PIECES[code][sq]
+        self._mg -= MG_TABLE[code][sq]
+        self._eg -= EG_TABLE[code][sq]
+        self._phase -= PHASE_TABLE[code]
+        return code
+
+    def evaluate(self):
+        """
+        static evaluation in centipawns from the point of view of the side to move: material and
+        piece-square scores, tapered between middlegame and endgame by the remaining pieces. The
+        scores are kept up to date whenever a piece is put or removed, so this costs O(1).
+        """
+        phase = min(self._phase, PHASE_TOTAL)
+        score = (self._mg * phase + self._eg * (PHASE_TOTAL - phase)) // PHASE_TOTAL
+        return -score if self.turn else score
+
+    @property
+    def zobrist_key(self):
+        """
+        64-bit Zobrist hash of the position. The piece part is updated incrementally whenever a
+        piece is put or removed, side to move, castling rights and en passant square are mixed in here.
+        """
+        return (self._piece_key ^ ZOBRIST_TURN[self.turn] ^ ZOBRIST_CASTLING[self.castling_rights]
+                ^ ZOBRIST_EP[self.ep_square])
+
+    @property
+    def side_to_move(self):
+        """color of the side to move, WHITE or BLACK"""
+        return COLORS[self.turn]
+
+    def make_move(self, move):
+        """
+        play encoded move (see encode_move) on the board in place. The move is not checked for
+        legality. Castling and en passant are recognized from the king and pawn moves themselves.
+        """
+        from_sq = move & 63
+        to_sq = move >> 6 & 63
+        mailbox = self.mailbox
+        captured = mailbox[to_sq]
+        ep_square = self.ep_square
+        self._stack.append((move, captured, self.castling_rights, ep_square, self.halfmove_clock))
+        if captured != NO_PIECE:
+            self._remove(to_sq)
+        code = self._remove(from_sq)
+        piece_type = code % 6
+        self.ep_square = None
+        if piece_type == 0:
+            self.halfmove_clock = 0
+            if to_sq == ep_square:
+                self._remove(to_sq - 8 if code < 6 else to_sq + 8)
+            elif to_sq - from_sq in (16, -16):
+                self.ep_square = (from_sq + to_sq) // 2
+            elif move >> 12:
+                code += move >> 12
+        elif captured != NO_PIECE:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        self._put(to_sq, code)
+        if piece_type == 5 and to_sq - from_sq in (2, -2):
+            rook_from, rook_to = CASTLING_ROOK_MOVES[to_sq]
+            self._put(rook_to, self._remove(rook_from))
+        self.castling_rights &= CASTLING_MASKS[from_sq] & CASTLING_MASKS[to_sq]
+        if self.turn:
+            self.fullmove_number += 1
+        self.turn ^= 1
+
+    def unmake_move(self):
+        """take back the last move played with make_move and return it"""
+        move, captured, castling_rights, ep_square, halfmove_clock = self._stack.pop()
+        from_sq = move & 63
+        to_sq = move >> 6 & 63
+        self.turn ^= 1
+        if self.turn:
+            self.fullmove_number -= 1
+        code = self._remove(to_sq)
+        if move >> 12:
+            code = self.turn * 6
+        self._put(from_sq, code)
+        if captured != NO_PIECE:
+            self._put(to_sq, captured)
+        elif code % 6 == 0 and to_sq == ep_square:
+            if code < 6:
+                self._put(to_sq - 8, 6)
+            else:
+                self._put(to_sq + 8, 0)
+        elif code % 6 == 5 and to_sq - from_sq in (2, -2):
+            rook_from, rook_to = CASTLING_ROOK_MOVES[to_sq]
+            self._put(rook_from, self._remove(rook_to))
+        self.castling_rights = castling_rights
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        return move
+
+    def is_attacked(self, sq, color):
+        """check if square is attacked by any piece of color index"""
+        bitboards = self.bitboards
+        occupied = self.occupied
+        base = color * 6
+        return bool(PAWN_ATTACKS[color ^ 1][sq] & bitboards[base]
+                    or KNIGHT_ATTACKS[sq] & bitboards[base + 1]
+                    or KING_ATTACKS[sq] & bitboards[base + 5]
+                    or BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]] & (bitboards[base + 2] | bitboards[base + 4])
+                    or ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]] & (bitboards[base + 3] | bitboards[base + 4]))
+
+    def is_quiet(self, move):
+        """check if move of the side to move neither captures, including en passant, nor promotes"""
+        to_sq = move >> 6 & 63
+        mailbox = self.mailbox
+        return (mailbox[to_sq] == NO_PIECE and not move >> 12
+                and not (to_sq == self.ep_square and mailbox[move & 63] % 6 == 0))
+
+    def is_check(self):
+        """check if the king of the side to move is attacked"""
+        return bool(self.attack_info(self.turn)[1])
+
+    def attack_info(self, color):
+        """
+        return (king square, checkers, check mask, attacked squares, pinned pieces, pin rays) for
+        the side with color index. Checkers are the enemy pieces giving check, the check mask the
+        squares a non-king move must go to to resolve a check (all squares if not in check, none in
+        double check), attacked squares all squares the enemy attacks with the king itself removed
+        from the board, and pin rays map each pinned piece's square to the squares it may move to.
+        Bitboards are None/empty if the side has no king. The result is computed once and cached
+        until the pieces on the board change.
+        """
+        cached = self._attack_cache[color]
+        if cached is not None and cached[0] == self._piece_key:
+            return cached[1]
+        bitboards = self.bitboards
+        king = bitboards[color * 6 + 5]
+        if not king:
+            info = (None, BB_EMPTY, BB_ALL, BB_EMPTY, BB_EMPTY, {})
+            self._attack_cache[color] = (self._piece_key, info)
+            return info
+        king_sq = king.bit_length() - 1
+        them = color ^ 1
+        base = them * 6
+        occupied = self.occupied
+        pawns = bitboards[base]
+        knights = bitboards[base + 1]
+        diagonal = bitboards[base + 2] | bitboards[base + 4]
+        straight = bitboards[base + 3] | bitboards[base + 4]
+
+        checkers = ((PAWN_ATTACKS[color][king_sq] & pawns) | (KNIGHT_ATTACKS[king_sq] & knights)
+                    | (BISHOP_TABLES[king_sq][occupied & BISHOP_MASKS[king_sq]] & diagonal)
+                    | (ROOK_TABLES[king_sq][occupied & ROOK_MASKS[king_sq]] & straight))
+        if not checkers:
+            check_mask = BB_ALL
+        elif checkers & (checkers - 1):
+            check_mask = BB_EMPTY
+        else:
+            check_mask = checkers | BB_BETWEEN[king_sq][checkers.bit_length() - 1]
+
+        own = self.occupied_co[color]
+        pinned = BB_EMPTY
+        pin_rays = {}
+        snipers = ((BISHOP_TABLES[king_sq][BB_EMPTY] & diagonal) | (ROOK_TABLES[king_sq][BB_EMPTY] & straight))
+        while snipers:
+            sniper = snipers & -snipers
+            snipers ^= sniper
+            sniper_sq = sniper.bit_length() - 1
+            blockers = BB_BETWEEN[king_sq][sniper_sq] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinned |= blockers
+                pin_rays[blockers.bit_length() - 1] = BB_BETWEEN[king_sq][sniper_sq] | sniper
+
+        if them:
+            attacked = ((pawns >> 7) & ~BB_FILE_A) | ((pawns >> 9) & ~BB_FILE_H)
+        else:
+            attacked = ((pawns << 7) & ~BB_FILE_H & BB_ALL) | ((pawns << 9) & ~BB_FILE_A & BB_ALL)
+        occupied_without_king = occupied & ~king
+        for piece_type in (1, 2, 3, 4, 5):
+            pieces = bitboards[base + piece_type]
+            while pieces:
+                lsb = pieces & -pieces
+                pieces ^= lsb
+                attacked |= piece_attacks(piece_type, lsb.bit_length() - 1, occupied_without_king)
+
+        info = (king_sq, checkers, check_mask, attacked, pinned, pin_rays)
+        self._attack_cache[color] = (self._piece_key, info)
+        return info
+
+    def is_legal(self, move):
+        """
+        check if a pseudo-legal move of the side to move leaves its own king safe, using the
+        cached attack information of the position
+        """
+        king_sq, checkers, check_mask, attacked, pinned, pin_rays = self.attack_info(self.turn)
+        if king_sq is None:
+            return True
+        from_sq = move & 63
+        to_sq = move >> 6 & 63
+        if from_sq == king_sq:
+            return not attacked & BB_SQUARES[to_sq]
+        if to_sq == self.ep_square and self.mailbox[from_sq] % 6 == 0:
+            # en passant removes two pieces from a line through the king, check it the slow way
+            self.make_move(move)
+            legal = not self.is_attacked(king_sq, self.turn)
+            self.unmake_move()
+            return legal
+        if not check_mask & BB_SQUARES[to_sq]:
+            return False
+        if pinned & BB_SQUARES[from_sq]:
+            return bool(pin_rays[from_sq] & BB_SQUARES[to_sq])
+        return True
+
+    def generate_moves(self):
+        """
+        return list of pseudo-legal moves (see encode_move) of the side to move: all moves that
+        follow the movement rules including captures, castling, en passant and promotion, but may
+        leave the own king in check
+        """
+        moves = []
+        append = moves.append
+        self._generate_piece_moves(append, ~self.occupied_co[self.turn] & BB_ALL)
+        self._generate_pawn_moves(append, True, True)
+        self._generate_castling_moves(append)
+        return moves
+
+    def generate_captures(self):
+        """return list of pseudo-legal captures and promotions of the side to move"""
+        moves = []
+        append = moves.append
+        self._generate_piece_moves(append, self.occupied_co[self.turn ^ 1])
+        self._generate_pawn_moves(append, True, False)
+        return moves
+
+    def generate_quiets(self):
+        """return list of pseudo-legal moves of the side to move that neither capture nor promote"""
+        moves = []
+        append = moves.append
+        self._generate_piece_moves(append, ~self.occupied & BB_ALL)
+        self._generate_pawn_moves(append, False, True)
+        self._generate_castling_moves(append)
+        return moves
+
+    def generate_staged(self, hash_move=0, killers=(), history=None, quiets=True):
+        """
+        yield legal moves of the side to move lazily, in the order a search wants to try
+        them: the hash move, captures and queen promotions ordered by MVV-LVA (most valuable
+        victim, least valuable attacker), the killer moves, the remaining quiet moves, ordered by
+        the history table (indexed by the lowest 12 bits of a move) if one is given, and last the
+        underpromotions that do not capture. Each stage is only generated once the previous one
+        is used up, so a consumer that stops early, e.g. after a beta cutoff, does not pay for the
+        rest. quiets=False stops after the captures and queen promotions.
+        """
+        is_legal = self.is_legal
+        if hash_move and self.is_pseudo_legal(hash_move) and is_legal(hash_move):
+            yield hash_move
+        mailbox = self.mailbox
+        captures = self.generate_captures()
+        underpromotions = []
+        if captures:
+            # en passant and quiet promotions have an empty target, both count as taking a pawn
+            underpromotions = [move for move in captures
+                               if 0 < move >> 12 < 4 and mailbox[move >> 6 & 63] == NO_PIECE]
+            if underpromotions:
+                captures = [move for move in captures if move not in underpromotions]
+            captures.sort(key=lambda move: ((max(mailbox[move >> 6 & 63], 0) % 6 + (move >> 12)) * 8
+                                            - mailbox[move & 63] % 6), reverse=True)
+            for move in captures:
+                if move != hash_move and is_legal(move):
+                    yield move
+        if not quiets:
+            return
+        for move in killers:
+            if (move and move != hash_move and self.is_quiet(move)
+                    and self.is_pseudo_legal(move) and is_legal(move)):
+                yield move
+        moves = self.generate_quiets()
+        if history is not None:
+            moves.sort(key=lambda move: history[move & 4095], reverse=True)
+        for move in moves:
+            if move != hash_move and move not in killers and is_legal(move):
+                yield move
+        for move in underpromotions:
+            if move != hash_move and is_legal(move):
+                yield move
+
+    def is_pseudo_legal(self, move):
+        """check if move follows the movement rules for the side to move, e.g. a hash or killer move"""
+        from_sq = move & 63
+        to_sq = move >> 6 & 63
+        promotion = move >> 12
+        us = self.turn
+        code = self.mailbox[from_sq]
+        if code == NO_PIECE or code // 6 != us or self.occupied_co[us] & BB_SQUARES[to_sq]:
+            return False
+        piece_type = code % 6
+        occupied = self.occupied
+        if piece_type == 0:
+            if (to_sq >> 3 == (0 if us else 7)) != bool(promotion) or promotion > 4:
+                return False
+            step = -8 if us else 8
+            if to_sq == from_sq + step:
+                return not occupied & BB_SQUARES[to_sq]
+            if to_sq == from_sq + 2 * step:
+                return (from_sq >> 3 == (6 if us else 1)
+                        and not occupied & (BB_SQUARES[to_sq] | BB_SQUARES[from_sq + step]))
+            if PAWN_ATTACKS[us][from_sq] & BB_SQUARES[to_sq]:
+                return bool(self.occupied_co[us ^ 1] & BB_SQUARES[to_sq]) or to_sq == self.ep_square
+            return False
+        if promotion:
+            return False
+        if piece_type == 5 and to_sq - from_sq in (2, -2):
+            moves = []
+            self._generate_castling_moves(moves.append)
+            return move in moves
+        return bool(piece_attacks(piece_type, from_sq, occupied) & BB_SQUARES[to_sq])
+
+    def _generate_piece_moves(self, append, targets_mask):
+        """append pseudo-legal knight, bishop, rook, queen and king moves to squares in targets_mask"""
+        bitboards = self.bitboards
+        occupied = self.occupied
+        base = self.turn * 6
+        for piece_type in (1, 2, 3, 4, 5):
+            pieces = bitboards[base + piece_type]
+            while pieces:
+                lsb = pieces & -pieces
+                pieces ^= lsb
+                from_sq = lsb.bit_length() - 1
+                targets = piece_attacks(piece_type, from_sq, occupied) & targets_mask
+                while targets:
+                    target = targets & -targets
+                    targets ^= target
+                    append(from_sq | (target.bit_length() - 1) << 6)
+
+    def _generate_pawn_moves(self, append, noisy, quiet):
+        """
+        append pseudo-legal pawn moves of the side to move: captures and promotions if noisy,
+        other pushes if quiet
+        """
+        us = self.turn
+        pawns = self.bitboards[us * 6]
+        empty = ~self.occupied & BB_ALL
+        enemy = self.occupied_co[us ^ 1]
+        if self.ep_square is not None:
+            enemy |= BB_SQUARES[self.ep_square]
+        if us == 0:
+            single = (pawns << 8) & empty
+            double = ((single & BB_RANKS[2]) << 8) & empty
+            step, last_rank = 8, BB_RANKS[7]
+        else:
+            single = (pawns >> 8) & empty
+            double = ((single & BB_RANKS[5]) >> 8) & empty
+            step, last_rank = -8, BB_RANKS[0]
+        if noisy:
+            while pawns:
+                lsb = pawns & -pawns
+                pawns ^= lsb
+                from_sq = lsb.bit_length() - 1
+                targets = PAWN_ATTACKS[us][from_sq] & enemy
+                while targets:
+                    target = targets & -targets
+                    targets ^= target
+                    _append_pawn_move(append, from_sq, target.bit_length() - 1, target & last_rank)
+            promotions = single & last_rank
+            while promotions:
+                target = promotions & -promotions
+                promotions ^= target
+                to_sq = target.bit_length() - 1
+                _append_pawn_move(append, to_sq - step, to_sq, True)
+        if quiet:
+            single &= ~last_rank
+            while single:
+                target = single & -single
+                single ^= target
+                to_sq = target.bit_length() - 1
+                append((to_sq - step) | to_sq << 6)
+            while double:
+                target = double & -double
+                double ^= target
+                to_sq = target.bit_length() - 1
+                append((to_sq - 2 * step) | to_sq << 6)
+
+    def _generate_castling_moves(self, append):
+        """append castling moves of the side to move, the king may not be in or pass through check"""
+        rights = self.castling_rights >> (2 * self.turn) & 3
+        if not rights:
+            return
+        them = self.turn ^ 1
+        occupied = self.occupied
+        king_sq = 60 if self.turn else 4
+        if self.mailbox[king_sq] != self.turn * 6 + 5 or self.is_attacked(king_sq, them):
+            return
+        if (rights & 1 and not occupied & (BB_SQUARES[king_sq + 1] | BB_SQUARES[king_sq + 2])
+                and not self.is_attacked(king_sq + 1, them) and not self.is_attacked(king_sq + 2, them)):
+            append(king_sq | (king_sq + 2) << 6)
+        if (rights & 2 and not occupied & (BB_SQUARES[king_sq - 1] | BB_SQUARES[king_sq - 2] | BB_SQUARES[king_sq - 3])
+                and not self.is_attacked(king_sq - 1, them) and not self.is_attacked(king_sq - 2, them)):
+            append(king_sq | (king_sq - 2) << 6)
+
+    def legal_moves(self):
+        """return list of legal moves of the side to move"""
+        is_legal = self.is_legal
+        return [move for move in self.generate_moves() if is_legal(move)]
+
+    def legal_moves_from(self, sq):
+        """return list of legal moves of the piece on square, whether or not its side is to move"""
+        code = self.mailbox[sq]
+        if code == NO_PIECE:
+            raise ValueError("No piece on %s" % square_name(sq))
+        us = code // 6
+        turn, ep_square = self.turn, self.ep_square
+        if us != turn:
+            self.turn, self.ep_square = us, None
+        try:
+            piece_type = code % 6
+            moves = []
+            append = moves.append
+            if piece_type == 0:
+                self._generate_single_pawn_moves(append, sq)
+                is_legal = self.is_legal
+                return [move for move in moves if is_legal(move)]
+            # the attack info gives the legal targets of a piece without checking every move
+            king_sq, checkers, check_mask, attacked, pinned, pin_rays = self.attack_info(us)
+            if king_sq is None:
+                legal = BB_ALL
+            elif piece_type == 5:
+                legal = ~attacked
+            elif pinned & BB_SQUARES[sq]:
+                legal = check_mask & pin_rays[sq]
+            else:
+                legal = check_mask
+            targets = piece_attacks(piece_type, sq, self.occupied) & ~self.occupied_co[us] & legal & BB_ALL
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                append(sq | (target.bit_length() - 1) << 6)
+            if piece_type == 5 and sq == (60 if us else 4):
+                self._generate_castling_moves(append)
+            return moves
+        finally:
+            self.turn, self.ep_square = turn, ep_square
+
+    def _generate_single_pawn_moves(self, append, sq):
+        """append pseudo-legal moves of the pawn of the side to move on square"""
+        us = self.turn
+        occupied = self.occupied
+        enemy = self.occupied_co[us ^ 1]
+        if self.ep_square is not None:
+            enemy |= BB_SQUARES[self.ep_square]
+        step, last_rank = (-8, BB_RANKS[0]) if us else (8, BB_RANKS[7])
+        targets = PAWN_ATTACKS[us][sq] & enemy
+        while targets:
+            target = targets & -targets
+            targets ^= target
+            _append_pawn_move(append, sq, target.bit_length() - 1, target & last_rank)
+        to_sq = sq + step
+        if 0 <= to_sq < 64 and not occupied & BB_SQUARES[to_sq]:
+            _append_pawn_move(append, sq, to_sq, BB_SQUARES[to_sq] & last_rank)
+            if sq >> 3 == (6 if us else 1) and not occupied & BB_SQUARES[to_sq + step]:
+                append(sq | (to_sq + step) << 6)
+
+    def parse_san(self, san):
+        """
+        return the legal move of the side to move given in standard algebraic notation,
+        e.g. 'e4', 'Nbd7', 'exd6', 'e8=Q+' or 'O-O'. Raises ValueError if the move is
+        invalid, illegal or ambiguous.
+        """
+        text = san.rstrip('+#!?')
+        us = self.turn
+        if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+            from_sq = 60 if us else 4
+            move = encode_move(from_sq, from_sq + 2 if len(text) == 3 else from_sq - 2)
+            if self.mailbox[from_sq] == us * 6 + 5 and self.is_pseudo_legal(move) and self.is_legal(move):
+                return move
+            raise ValueError("Illegal move %s" % san)
+        promotion = 0
+        if text[-2:-1] == '=' or (text[-1:] in 'NBRQ' and text[:1] in FILES):
+            promotion = PROMOTION_IDX.get(text[-1].lower())
+            text = text[:-2] if text[-2:-1] == '=' else text[:-1]
+            if promotion is None:
+                raise ValueError("Invalid move %s" % san)
+        piece_type = SAN_PIECES.get(text[:1], 0)
+        if piece_type:
+            text = text[1:]
+        text = text.replace('x', '').replace('-', '')
+        try:
+            to_sq = square(text[-2], int(text[-1]))
+        except (IndexError, ValueError):
+            raise ValueError("Invalid move %s" % san)
+        sources = self.bitboards[us * 6 + piece_type]
+        if piece_type:
+            sources &= piece_attacks(piece_type, to_sq, self.occupied)
+        elif not text[:-2]:
+            sources &= BB_FILES[to_sq & 7]
+        for hint in text[:-2]:
+            if hint in FILES:
+                sources &= BB_FILES[FILES.index(hint)]
+            elif hint in '12345678':
+                sources &= BB_RANKS[int(hint) - 1]
+            else:
+                raise ValueError("Invalid move %s" % san)
+        candidates = []
+        while sources:
+            lsb = sources & -sources
+            sources ^= lsb
+            move = encode_move(lsb.bit_length() - 1, to_sq, promotion)
+            if self.is_pseudo_legal(move):
+                candidates.append(move)
+        if len(candidates) > 1:
+            candidates = [move for move in candidates if self.is_legal(move)]
+        elif candidates:
+            # a single candidate is cheaper to verify by playing it than by computing pins
+            king = self.bitboards[us * 6 + 5]
+            self.make_move(candidates[0])
+            if king and self.is_attacked(self.bitboards[us * 6 + 5].bit_length() - 1, us ^ 1):
+                candidates = []
+            self.unmake_move()
+        if len(candidates) > 1:
+            raise ValueError("Ambiguous move %s" % san)
+        if not candidates:
+            raise ValueError("Illegal move %s" % san)
+        return candidates[0]
+
+    @property
+    def pieces(self):
+        """set of all pieces currently on the board"""
+        return set(self.piece_at(sq) for sq in range(64) if self.mailbox[sq] != NO_PIECE)
 
     def clear_board(self):
-        """clear all pieces to create empty board"""
-        self.board = [[EMPTYCELL]*8 for _ in range(8)] 
-        for piece in self.pieces:
-            piece.board = None
+        """clear all pieces and move history to create empty board with white to move"""
+        self.bitboards = [BB_EMPTY] * 12
+        self.occupied_co = [BB_EMPTY, BB_EMPTY]
+        self.occupied = BB_EMPTY
+        self.mailbox = [NO_PIECE] * 64
+        self._piece_key = 0
+        self._attack_cache = [None, None]
+        self._mg = 0
+        self._eg = 0
+        self._phase = 0
+        self.turn = 0
+        self.castling_rights = 0
+        self.ep_square = None
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self._stack = []
+
+    @classmethod
+    def from_fen(cls, fen):
+        """create board from position in Forsyth-Edwards notation"""
+        board = cls()
+        board.set_fen(fen)
+        return board
+
+    def set_fen(self, fen):
+        """
+        set up position given in Forsyth-Edwards notation, the move counters may be omitted.
+        Pieces are written straight into the board arrays, no Piece objects are created.
+        """
+        fields = fen.split()
+        if len(fields) not in (4, 6):
+            raise ValueError("Invalid FEN %s" % fen)
+        self.clear_board()
+        bitboards = self.bitboards
+        mailbox = self.mailbox
+        piece_key = mg = eg = phase = 0
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError("Invalid FEN %s" % fen)
+        for rank_idx, row in enumerate(rows):
+            sq = (7 - rank_idx) * 8
+            end = sq + 8
+            for symbol in row:
+                if symbol in '12345678':
+                    sq += int(symbol)
+                    continue
+                code = FEN_CODES.get(symbol)
+                if code is None or sq >= end:
+                    raise ValueError("Invalid FEN %s" % fen)
+                mailbox[sq] = code
+                bitboards[code] |= BB_SQUARES[sq]
+                piece_key ^= ZOBRIST_PIECES[code][sq]
+                mg += MG_TABLE[code][sq]
+                eg += EG_TABLE[code][sq]
+                phase += PHASE_TABLE[code]
+                sq += 1
+            if sq != end:
+                raise ValueError("Invalid FEN %s" % fen)
+        white = bitboards[0] | bitboards[1] | bitboards[2] | bitboards[3] | bitboards[4] | bitboards[5]
+        black = bitboards[6] | bitboards[7] | bitboards[8] | bitboards[9] | bitboards[10] | bitboards[11]
+        self.occupied_co = [white, black]
+        self.occupied = white | black
+        self._piece_key, self._mg, self._eg, self._phase = piece_key, mg, eg, phase
+        if fields[1] not in ('w', 'b'):
+            raise ValueError("Invalid FEN %s" % fen)
+        self.turn = 0 if fields[1] == 'w' else 1
+        if fields[2] != '-':
+            for symbol in fields[2]:
+                rights = CASTLING_CODES.get(symbol)
+                if rights is None:
+                    raise ValueError("Invalid FEN %s" % fen)
+                self.castling_rights |= rights
+        if fields[3] != '-':
+            if len(fields[3]) != 2 or not fields[3][1].isdigit():
+                raise ValueError("Invalid FEN %s" % fen)
+            self.ep_square = square(fields[3][0], int(fields[3][1]))
+        if len(fields) == 6:
+            try:
+                self.halfmove_clock = int(fields[4])
+                self.fullmove_number = int(fields[5])
+            except ValueError:
+                raise ValueError("Invalid FEN %s" % fen)
+
+    def to_fen(self):
+        """return position in Forsyth-Edwards notation"""
+        mailbox = self.mailbox
+        rows = []
+        for rank_idx in range(7, -1, -1):
+            row = ''
+            empty = 0
+            for sq in range(rank_idx * 8, rank_idx * 8 + 8):
+                code = mailbox[sq]
+                if code == NO_PIECE:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += FEN_SYMBOLS[code]
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        castling = ''.join(symbol for symbol, rights in CASTLING_SYMBOLS if self.castling_rights & rights)
+        return '%s %s %s %s %d %d' % ('/'.join(rows), 'wb'[self.turn], castling or '-',
+                                      '-' if self.ep_square is None else square_name(self.ep_square),
+                                      self.halfmove_clock, self.fullmove_number)
+
+    def pack(self):
+        """return the position as PACKED_SIZE bytes, without the undo stack"""
+        mailbox = self.mailbox
+        occupied = self.occupied
+        codes = 0
+        shift = 0
+        bb = occupied
+        while bb:
+            lsb = bb & -bb
+            bb ^= lsb
+            codes |= mailbox[lsb.bit_length() - 1] << shift
+            shift += 4
+        if shift > 128:
+            raise ValueError("Cannot pack more than 32 pieces")
+        return PACKED_FORMAT.pack(occupied, codes & BB_ALL, codes >> 64, self.turn | self.castling_rights << 1,
+                                  0 if self.ep_square is None else self.ep_square + 1,
+                                  min(self.halfmove_clock, 255), min(self.fullmove_number, 65535))
+
+    @classmethod
+    def unpack(cls, data):
+        """create board from a position returned by pack"""
+        board = cls()
+        board.set_packed(data)
+        return board
+
+    def set_packed(self, data):
+        """set up position returned by pack, data may be any bytes-like object of PACKED_SIZE bytes"""
+        try:
+            occupied, low, high, flags, ep, halfmove, fullmove = PACKED_FORMAT.unpack(data)
+        except struct.error:
+            raise ValueError("Invalid packed position")
+        self.clear_board()
+        bitboards = self.bitboards
+        mailbox = self.mailbox
+        piece_key = mg = eg = phase = 0
+        codes = low | high << 64
+        bb = occupied
+        while bb:
+            lsb = bb & -bb
+            bb ^= lsb
+            sq = lsb.bit_length() - 1
+            code = codes & 15
+            codes >>= 4
+            if code >= 12:
+                raise ValueError("Invalid packed position")
+            mailbox[sq] = code
+            bitboards[code] |= lsb
+            piece_key ^= ZOBRIST_PIECES[code][sq]
+            mg += MG_TABLE[code][sq]
+            eg += EG_TABLE[code][sq]
+            phase += PHASE_TABLE[code]
+        white = bitboards[0] | bitboards[1] | bitboards[2] | bitboards[3] | bitboards[4] | bitboards[5]
+        self.occupied_co = [white, occupied & ~white]
+        self.occupied = occupied
+        self._piece_key, self._mg, self._eg, self._phase = piece_key, mg, eg, phase
+        self.turn = flags & 1
+        self.castling_rights = flags >> 1 & CASTLE_ALL
+        self.ep_square = ep - 1 if ep else None
+        self.halfmove_clock = halfmove
+        self.fullmove_number = fullmove
 
     def init_pieces(self):
         """Initialize board with pieces at the initial starting position of the game"""
@@ -62,49 +1165,81 @@ class Board(object):
         self.set_piece(Queen('d', 8, BLACK, self))
         self.set_piece(King('e', 1, WHITE, self))
         self.set_piece(King('e', 8, BLACK, self))
+        self.castling_rights = CASTLE_ALL
+
+    def __getstate__(self):
+        """
+        compact state for pickling: the twelve piece bitboards followed by side to move, castling
+        rights, en passant square and move counters. The undo stack is not part of the state.
+        """
+        return tuple(self.bitboards) + (self.turn, self.castling_rights, self.ep_square,
+                                        self.halfmove_clock, self.fullmove_number)
+
+    def __setstate__(self, state):
+        self.__init__()
+        for code, bb in enumerate(state[:12]):
+            while bb:
+                lsb = bb & -bb
+                bb ^= lsb
+                self._put(lsb.bit_length() - 1, code)
+        (self.turn, self.castling_rights, self.ep_square,
+         self.halfmove_clock, self.fullmove_number) = state[12:]
 
     def __str__(self):
         return '  ' + ''.join(['{:2}'.format(file) for file in self.files]) + '\n' +  \
-            '\n'.join([ '{:2}'.format(rank) + 
-                        ''.join(['{:2}'.format(str(self.get_piece_at_position(file, rank))) for file in self.files]) 
-                        + '{:2}'.format(rank) 
+            '\n'.join([ '{:2}'.format(rank) +
+                        ''.join(['{:2}'.format(str(self.get_piece_at_position(file, rank))) for file in self.files])
+                        + '{:2}'.format(rank)
                         for rank in reversed(self.ranks)]) + \
                         '\n  ' + ''.join(['{:2}'.format(file) for file in self.files])
 
 
 class Piece(object):
     """
-    Class representing a chess piece
+    Class representing a chess piece. The board only keeps piece codes, pieces are created on
+    demand and are not part of a board copy. The board a piece was taken from is optional and
+    only used to look up its moves, valid_moves also takes the board as argument.
     """
-    
-    def __init__(self, file, rank, board):
-        if file not in board.files or rank not in board.ranks:
+
+    __slots__ = ('file', 'rank', 'color', 'square', 'board')
+
+    def __init__(self, file, rank, board=None):
+        sq = SQUARE_IDX.get((file, rank))
+        if sq is None:
             raise ValueError("Invalid board position %s %d" % (file, rank))
         self.file = file
         self.rank = rank
         self.board = board
+        self.square = sq
+
+    @property
+    def index(self):
+        """integer piece code used by the board representation"""
+        return COLOR_IDX[self.color] * 6 + TYPE_IDX[self.piece_type]
+
+    def valid_moves(self, board=None):
+        """set of (file, rank) positions the piece can legally move to, including captures"""
+        return set(SQUARE_POSITIONS[move >> 6 & 63] for move in self._legal_moves(board))
+
+    def _legal_moves(self, board=None):
+        """legal moves of the piece, which has to be placed on board or the board it was taken from"""
+        board = board if board is not None else self.board
+        if board is None:
+            raise ValueError("Piece at %s is not on a board" % square_name(self.square))
+        if board.mailbox[self.square] != self.index:
+            raise ValueError("Piece is not on the board at %s" % square_name(self.square))
+        return board.legal_moves_from(self.square)
 
 
 class King(Piece):
 
-    def __init__(self, file, rank, color, board):
+    __slots__ = ()
+    piece_type = KING
+
+    def __init__(self, file, rank, color, board=None):
         super(King, self).__init__(file, rank, board)
         self.color = color
 
-    def valid_moves(self):
-        moves = set()
-        for file_move, rank_move in [(1,-1), (1,0), (1,1), (0,-1), (0,1), (-1,-1),(-1,0), (-1,1)]: 
-            target_file = self.board.file_to_idx(self.file)+file_move
-            if target_file < 1 or target_file > 8:
-                continue
-            target_file = self.board.files[target_file]
-            target_rank = self.rank + rank_move
-            if target_rank not in self.board.ranks:
-                continue
-            if self.board.is_empty(target_file, target_rank):
-                moves.add((target_file, target_rank))
-        return moves
-
     def __str__(self):
         return "\u2654" if self.color == WHITE else "\u265A"
 
@@ -115,45 +1250,18 @@ class King(Piece):
         return False
 
     def __hash__(self):
-        return hash(self.file) ^ hash(self.rank) ^ hash(self.color) ^ hash(KING)
-    
+        return ZOBRIST_PIECES[self.index][self.square]
+
 
 class Queen(Piece):
 
-    def __init__(self, file, rank, color, board):
+    __slots__ = ()
+    piece_type = QUEEN
+
+    def __init__(self, file, rank, color, board=None):
         super(Queen, self).__init__(file, rank, board)
         self.color = color
 
-    def valid_moves(self):
-        moves = set()
-        # horizontal and vertical moves
-        directions = [[(self.file, rank) for rank in range(self.rank-1, 0, -1)],
-                      [(self.file, rank) for rank in range(self.rank+1, 9)],
-                      [(file, self.rank) for file in self.board.files[(self.board.file_to_idx(self.file)+1):]],
-                      [(file, self.rank) for file in reversed(self.board.files[:self.board.file_to_idx(self.file)])]]
-        for direction in directions:
-            for file, rank in direction:
-                if self.board.is_empty(file, rank):
-                    moves.add((file, rank))
-                else:
-                    break
-        # diagonal moves
-        file_left = list(reversed(self.board.files[:self.board.file_to_idx(self.file)]))
-        file_right = self.board.files[(self.board.file_to_idx(self.file)+1):]
-        rank_bottom = list(range(self.rank-1, 0, -1))
-        rank_top = list(range(self.rank+1, 9))
-        directions = [ zip(file_left, rank_bottom),
-                       zip(file_left, rank_top),
-                       zip(file_right, rank_bottom),
-                       zip(file_right, rank_top)]
-        for direction in directions:
-            for file, rank in direction:
-                if self.board.is_empty(file, rank):
-                    moves.add((file, rank))
-                else:
-                    break
-        return moves
-
     def __str__(self):
         return "\u2655" if self.color == WHITE else "\u265B"
 
@@ -163,29 +1271,18 @@ class Queen(Piece):
         return False
 
     def __hash__(self):
-        return hash(self.file) ^ hash(self.rank) ^ hash(self.color) ^ hash(QUEEN)
+        return ZOBRIST_PIECES[self.index][self.square]
+
 
-    
 class Rook(Piece):
 
-    def __init__(self, file, rank, color, board):
+    __slots__ = ()
+    piece_type = ROOK
+
+    def __init__(self, file, rank, color, board=None):
         super(Rook, self).__init__(file, rank, board)
         self.color = color
 
-    def valid_moves(self):
-        moves = set()
-        directions = [[(self.file, rank) for rank in range(self.rank-1, 0, -1)],
-                      [(self.file, rank) for rank in range(self.rank+1, 9)],
-                      [(file, self.rank) for file in self.board.files[(self.board.file_to_idx(self.file)+1):]],
-                      [(file, self.rank) for file in reversed(self.board.files[:self.board.file_to_idx(self.file)])]]
-        for direction in directions:
-            for file, rank in direction:
-                if self.board.is_empty(file, rank):
-                    moves.add((file, rank))
-                else:
-                    break
-        return moves
-
     def __str__(self):
         return "\u2656" if self.color == WHITE else "\u265C"
 
@@ -195,33 +1292,18 @@ class Rook(Piece):
         return False
 
     def __hash__(self):
-        return hash(self.file) ^ hash(self.rank) ^ hash(self.color) ^ hash(ROOK)
+        return ZOBRIST_PIECES[self.index][self.square]
 
 
 class Bishop(Piece):
 
-    def __init__(self, file, rank, color, board):
+    __slots__ = ()
+    piece_type = BISHOP
+
+    def __init__(self, file, rank, color, board=None):
         super(Bishop, self).__init__(file, rank, board)
         self.color = color
 
-    def valid_moves(self):
-        moves = set()
-        file_left = list(reversed(self.board.files[:self.board.file_to_idx(self.file)]))
-        file_right = self.board.files[(self.board.file_to_idx(self.file)+1):]
-        rank_bottom = list(range(self.rank-1, 0, -1))
-        rank_top = list(range(self.rank+1, 9))
-        directions = [ zip(file_left, rank_bottom),
-                       zip(file_left, rank_top),
-                       zip(file_right, rank_bottom),
-                       zip(file_right, rank_top)]
-        for direction in directions:
-            for file, rank in direction:
-                if self.board.is_empty(file, rank):
-                    moves.add((file, rank))
-                else:
-                    break
-        return moves
-
     def __str__(self):
         return "\u2657" if self.color == WHITE else "\u265D"
 
@@ -231,29 +1313,18 @@ class Bishop(Piece):
         return False
 
     def __hash__(self):
-        return hash(self.file) ^ hash(self.rank) ^ hash(self.color) ^ hash(BISHOP)
+        return ZOBRIST_PIECES[self.index][self.square]
 
 
 class Knight(Piece):
 
-    def __init__(self, file, rank, color, board):
+    __slots__ = ()
+    piece_type = KNIGHT
+
+    def __init__(self, file, rank, color, board=None):
         super(Knight, self).__init__(file, rank, board)
         self.color = color
 
-    def valid_moves(self):
-        moves = set()
-        for file_move, rank_move in [(1,-2), (1,2), (-1,-2), (-1,2), (2,-1), (2,1),(-1,2), (-2,1), (-2,-1)]: 
-            target_file = self.board.file_to_idx(self.file)+file_move
-            if target_file < 1 or target_file > 8:
-                continue
-            target_file = self.board.files[target_file]
-            target_rank = self.rank + rank_move
-            if target_rank not in self.board.ranks:
-                continue
-            if self.board.is_empty(target_file, target_rank):
-                moves.add((target_file, target_rank))
-        return moves
-
     def __str__(self):
         return "\u2658" if self.color == WHITE else "\u265E"
 
@@ -263,29 +1334,24 @@ class Knight(Piece):
         return False
 
     def __hash__(self):
-        return hash(self.file) ^ hash(self.rank) ^ hash(self.color) ^ hash(KNIGHT)
+        return ZOBRIST_PIECES[self.index][self.square]
 
 
 class Pawn(Piece):
 
-    def __init__(self, file, rank, color, board):
+    __slots__ = ()
+    piece_type = PAWN
+
+    def __init__(self, file, rank, color, board=None):
         super(Pawn, self).__init__(file, rank, board)
         self.color = color
 
-    def valid_moves(self):
+    def valid_moves(self, board=None):
         moves = []
-        if self.color == WHITE:
-            if self.board.is_empty(self.file, self.rank+1):
-                moves.append((self.file, self.rank+1))
-                if self.rank == 2 and self.board.is_empty(self.file, self.rank+2):
-                    moves.append((self.file, self.rank+2))
-        elif self.color == BLACK:
-            if self.board.is_empty(self.file, self.rank-1):
-                moves.append((self.file, self.rank-1))
-                if self.rank == 7 and self.board.is_empty(self.file, self.rank-2):
-                    moves.append((self.file, self.rank-2))
-        else:
-            assert False
+        for move in self._legal_moves(board):
+            position = SQUARE_POSITIONS[move >> 6 & 63]
+            if position not in moves:
+                moves.append(position)
         return moves
 
     def __str__(self):
@@ -297,4 +1363,114 @@ class Pawn(Piece):
         return False
 
     def __hash__(self):
-        return hash(self.file) ^ hash(self.rank) ^ hash(self.color) ^ hash(PAWN)
+        return ZOBRIST_PIECES[self.index][self.square]
+
+
+PIECE_CLASSES = [Pawn, Knight, Bishop, Rook, Queen, King]
+
+
+def read_epd(source, board=None):
+    """
+    yield (board, operations) for every position of an EPD or FEN file, one line at a time so
+    memory use does not grow with the file. source is a file name (gzip compressed if it ends in
+    .gz) or an iterable of lines. Operations map EPD opcodes to their operand string, e.g.
+    {'bm': 'Nf3', 'D1': '20'}. If board is given, every position is set up in that board instead
+    of a new one, which is faster but the board is only valid until the next position is read.
+    """
+    if isinstance(source, str):
+        opener = gzip.open if source.endswith('.gz') else open
+        with opener(source, 'rt') as lines:
+            for item in read_epd(lines, board):
+                yield item
+        return
+    for line in source:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(None, 4)
+        if len(fields) < 4:
+            raise ValueError("Invalid EPD %s" % line)
+        rest = fields[4] if len(fields) == 5 else ''
+        counters = rest.split(None, 2)
+        fen = ' '.join(fields[:4])
+        if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():
+            fen += ' %s %s' % (counters[0], counters[1])
+            rest = counters[2] if len(counters) == 3 else ''
+        operations = {}
+        for operation in rest.split(';'):
+            opcode, _, operand = operation.strip().partition(' ')
+            if opcode:
+                operations[opcode] = operand.strip().strip('"')
+        position = board if board is not None else Board()
+        position.set_fen(fen)
+        yield position, operations
+
+
+# bound types of transposition table scores
+TT_EXACT = 0
+TT_LOWER = 1
+TT_UPPER = 2
+TT_SCORE_OFFSET = 1 << 31
+
+
+class TranspositionTable(object):
+    """
+    Fixed size hash table of search results keyed by Board.zobrist_key.
+
+    Entries live in two flat arrays of 64-bit integers (keys and packed data), grouped into
+    buckets of two slots. The first slot keeps the deepest result of the current search and is
+    only replaced by an equal or deeper one (or any result once a new search started), the second
+    slot is always replaced. Data packs move (16 bits), depth (8 bits), bound type (2 bits),
+    search generation (6 bits) and the score offset by 2**31 (32 bits).
+    """
+
+    def __init__(self, size_mb=16):
+        buckets = 1
+        while buckets * 2 * 32 <= size_mb * 1024 * 1024:
+            buckets *= 2
+        self.mask = buckets - 1
+        self.keys = array('Q', bytes(16 * buckets))
+        self.data = array('Q', bytes(16 * buckets))
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        """remove all entries"""
+        self.keys = array('Q', bytes(8 * len(self.keys)))
+        self.data = array('Q', bytes(8 * len(self.data)))
+        self.generation = 0
+
+    def new_search(self):
+        """start a new search generation, entries of older searches become replaceable"""
+        self.generation = (self.generation + 1) & 63
+
+    def probe(self, key):
+        """return (depth, score, bound, move) stored for key or None"""
+        slot = (key & self.mask) << 1
+        keys = self.keys
+        if keys[slot] != key:
+            slot += 1
+            if keys[slot] != key:
+                return None
+        data = self.data[slot]
+        return (data >> 16 & 255, (data >> 32) - TT_SCORE_OFFSET, data >> 24 & 3, data & 0xFFFF)
+
+    def store(self, key, depth, score, bound, move=0):
+        """store search result for key, depth must be in 0..255 and score fit into 32 bits"""
+        slot = (key & self.mask) << 1
+        data = (move | depth << 16 | bound << 24 | self.generation << 26
+                | (score + TT_SCORE_OFFSET) << 32)
+        old = self.data[slot]
+        if self.keys[slot] == key or depth >= (old >> 16 & 255) or (old >> 26 & 63) != self.generation:
+            self.keys[slot] = key
+            self.data[slot] = data
+        else:
+            self.keys[slot + 1] = key
+            self.data[slot + 1] = data
+
+
+if __name__ == '__main__':
+    import uci
+    sys.exit(uci.main())
@@ -0,0 +1,253 @@
+"""
+Opt-in instrumentation of the hot paths of Board, the pieces, the transposition table and the
+search.
+
+Nothing is measured by default. enable() replaces the instrumented methods with wrappers that
+count calls, cache hits and misses and the time spent per phase, disable() puts the original
+methods back, so the instrumentation costs nothing while it is off.
+
+    with instrument.instrumented() as counters:
+        perft.perft(board, 4)
+    print(counters.to_json())
+
+    python perft.py --depth 4 --counters
+    python perft.py --depth 4 --profile cprofile
+"""
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+import functools
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+import chess
+import search
+
+
+class Counters(object):
+    """Counters collects call counts, cache hits and misses and seconds per phase"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = Counter()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.seconds = Counter()
+
+    def snapshot(self):
+        """dict of the current counts, safe to keep while counting goes on"""
+        return {
+            'calls': dict(self.calls),
+            'squares_probed': sum(self.calls[name] for name in SQUARE_PROBES),
+            'cache': dict((name, {'hits': self.hits[name], 'misses': self.misses[name]})
+                          for name in sorted(set(self.hits) | set(self.misses))),
+            'seconds': dict(self.seconds),
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+
+counters = Counters()
+_originals = []
+
+# get_piece_at_position probes through piece_at, counting both would count its squares twice
+SQUARE_PROBES = ('Board.is_empty', 'Board.piece_at')
+
+
+def _counted(function, name):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        counters.calls[name] += 1
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def _timed(function, name):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        counters.calls[name] += 1
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            counters.seconds[name] += time.perf_counter() - start
+    return wrapper
+
+
+def _per_piece(function, name):
+    """count calls of a Piece method by piece class"""
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        counters.calls['%s.%s' % (type(self).__name__, name)] += 1
+        return function(self, *args, **kwargs)
+    return wrapper
+
+
+def _per_square_piece(function, name):
+    """count calls of a Board method taking a square by the type of the piece on it"""
+    @functools.wraps(function)
+    def wrapper(self, sq, *args, **kwargs):
+        code = self.mailbox[sq]
+        piece = chess.PIECE_TYPES[code % 6] if code != chess.NO_PIECE else 'empty'
+        counters.calls['%s.%s' % (name, piece)] += 1
+        return function(self, sq, *args, **kwargs)
+    return wrapper
+
+
+def _per_generated_piece(function, name):
+    """count the moves a move generator taking an append function produces by piece type"""
+    @functools.wraps(function)
+    def wrapper(self, append, *args, **kwargs):
+        mailbox = self.mailbox
+        calls = counters.calls
+
+        def counting_append(move):
+            calls['%s.%s' % (name, chess.PIECE_TYPES[mailbox[move & 63] % 6])] += 1
+            append(move)
+
+        return function(self, counting_append, *args, **kwargs)
+    return wrapper
+
+
+def _attack_cache(function, name):
+    @functools.wraps(function)
+    def wrapper(self, color):
+        cached = self._attack_cache[color]
+        if cached is not None and cached[0] == self._piece_key:
+            counters.hits[name] += 1
+        else:
+            counters.misses[name] += 1
+        return function(self, color)
+    return wrapper
+
+
+def _table_probe(function, name):
+    @functools.wraps(function)
+    def wrapper(self, key):
+        entry = function(self, key)
+        if entry is None:
+            counters.misses[name] += 1
+        else:
+            counters.hits[name] += 1
+        return entry
+    return wrapper
+
+
+def _targets():
+    """(owner, attribute, wrapper factory, counter name) of every instrumented method"""
+    targets = [
+        (chess.Board, '__init__', _counted, 'Board.created'),
+        (chess.Board, 'copy', _counted, 'Board.created'),
+        (chess.Board, 'set_fen', _counted, 'Board.set_fen'),
+        (chess.Board, 'set_packed', _counted, 'Board.set_packed'),
+        (chess.Board, 'is_empty', _counted, 'Board.is_empty'),
+        (chess.Board, 'get_piece_at_position', _counted, 'Board.get_piece_at_position'),
+        (chess.Board, 'piece_at', _counted, 'Board.piece_at'),
+        (chess.Board, 'make_move', _counted, 'Board.make_move'),
+        (chess.Board, 'unmake_move', _counted, 'Board.unmake_move'),
+        (chess.Board, 'generate_moves', _timed, 'Board.generate_moves'),
+        (chess.Board, 'generate_captures', _timed, 'Board.generate_captures'),
+        (chess.Board, 'generate_quiets', _timed, 'Board.generate_quiets'),
+        (chess.Board, 'generate_staged', _counted, 'Board.generate_staged'),
+        (chess.Board, 'legal_moves', _timed, 'Board.legal_moves'),
+        (chess.Board, 'legal_moves_from', _per_square_piece, 'Board.legal_moves_from'),
+        (chess.Board, '_generate_piece_moves', _per_generated_piece, 'generated'),
+        (chess.Board, '_generate_pawn_moves', _per_generated_piece, 'generated'),
+        (chess.Board, '_generate_single_pawn_moves', _per_generated_piece, 'generated'),
+        (chess.Board, '_generate_castling_moves', _per_generated_piece, 'generated'),
+        (chess.Board, 'evaluate', _timed, 'Board.evaluate'),
+        (chess.Board, 'attack_info', _attack_cache, 'attack_info'),
+        (chess.Piece, 'valid_moves', _per_piece, 'valid_moves'),
+        (chess.Pawn, 'valid_moves', _per_piece, 'valid_moves'),
+        (chess.TranspositionTable, 'probe', _table_probe, 'transposition_table'),
+        (chess.TranspositionTable, 'store', _counted, 'TranspositionTable.store'),
+        (search.Searcher, 'search', _timed, 'Searcher.search'),
+    ]
+    return targets
+
+
+def enabled():
+    return bool(_originals)
+
+
+def enable():
+    """start counting by wrapping the instrumented methods"""
+    if _originals:
+        return
+    for owner, attribute, factory, name in _targets():
+        original = owner.__dict__[attribute]
+        _originals.append((owner, attribute, original))
+        setattr(owner, attribute, factory(original, name))
+
+
+def disable():
+    """stop counting and restore the original methods, the counts are kept"""
+    while _originals:
+        owner, attribute, original = _originals.pop()
+        setattr(owner, attribute, original)
+
+
+@contextmanager
+def instrumented(reset=True):
+    """count while the block runs and yield the counters"""
+    if reset:
+        counters.reset()
+    was_enabled = enabled()
+    enable()
+    try:
+        yield counters
+    finally:
+        if not was_enabled:
+            disable()
+
+
+@contextmanager
+def phase(name):
+    """add the time the block takes to the seconds of phase name, while counting is enabled"""
+    if not _originals:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        counters.seconds[name] += time.perf_counter() - start
+
+
+@contextmanager
+def profiled(kind, stream, limit=25):
+    """
+    run the block under cProfile ('cprofile') or tracemalloc ('tracemalloc') and write the
+    top limit entries of the report to stream. Does nothing if kind is None.
+    """
+    if kind is None:
+        yield
+    elif kind == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(limit)
+            stream.write(report.getvalue())
+    elif kind == 'tracemalloc':
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stream.write('current %d bytes, peak %d bytes\n' % (current, peak))
+            for statistic in snapshot.statistics('lineno')[:limit]:
+                stream.write('%s\n' % statistic)
+    else:
+        raise ValueError("Unknown profiler %s" % kind)
@@ -0,0 +1,83 @@
+"""
+Spread work on the subtrees below a position across a pool of worker processes.
+
+The root position is sent to every worker once, as the compact state returned by
+Board.__getstate__. Tasks are short tuples of encoded moves leading from the root to the
+position a worker should look at, so no Board or Piece objects travel between processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import chess
+
+
+_root = None
+
+
+def default_workers():
+    """number of worker processes used when none is given"""
+    return os.cpu_count() or 1
+
+
+def split_moves(board, plies):
+    """
+    return list of legal move sequences from board that are plies deep, or shorter where the
+    game ends earlier
+    """
+    if plies == 0:
+        return [()]
+    sequences = []
+    moves = board.legal_moves()
+    if not moves:
+        return [()]
+    for move in moves:
+        board.make_move(move)
+        sequences.extend((move,) + sequence for sequence in split_moves(board, plies - 1))
+        board.unmake_move()
+    return sequences
+
+
+def _init_worker(state):
+    global _root
+    _root = chess.Board()
+    _root.__setstate__(state)
+
+
+def _run_task(task):
+    function, moves, args = task
+    for move in moves:
+        _root.make_move(move)
+    try:
+        return function(_root, *args)
+    finally:
+        for _ in moves:
+            _root.unmake_move()
+
+
+def map_moves(board, sequences, function, args=(), workers=None):
+    """
+    return [function(position, *args) for every move sequence], where position is board after
+    playing the sequence. function must be a module level function (it is pickled by name) and
+    must leave the position as it found it. Results are computed by a pool of workers processes.
+    """
+    return map_tasks(board, [(function, sequence, args) for sequence in sequences], workers)
+
+
+def map_tasks(board, tasks, workers=None):
+    """
+    like map_moves for a list of (function, sequence, args) tasks, e.g. to pass different
+    arguments for every move sequence
+    """
+    workers = workers or default_workers()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(board.__getstate__(),)) as pool:
+        return list(pool.map(_run_task, tasks, chunksize=1))
+
+
+def split_plies(board, depth, workers):
+    """
+    number of plies to split at: the root moves alone if there are enough of them to keep all
+    workers busy with subtrees of uneven size, otherwise the moves two plies deep
+    """
+    if depth <= 1 or len(board.legal_moves()) >= 4 * workers:
+        return 1
+    return 2
@@ -0,0 +1,211 @@
+"""
+Perft: count the leaf nodes of the legal move tree of a position to a fixed depth.
+
+Perft numbers of well known positions are published, so comparing against them checks
+the move generator for correctness, and timing the count measures its throughput.
+
+    python perft.py --depth 3                       run the bundled suite up to depth 3
+    python perft.py --fen "<fen>" --depth 4 --divide
+    python perft.py --depth 3 --json > base.json    machine readable results
+    python perft.py --depth 3 --baseline base.json  fail on wrong counts or slowdowns
+    python perft.py --depth 5 --workers 8           split the tree across 8 processes
+    python perft.py --depth 3 --counters            print call counts and timings to stderr
+    python perft.py --depth 3 --profile cprofile    profile the run with cProfile or tracemalloc
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import chess
+import instrument
+import parallel
+
+
+SUITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perft_suite.epd')
+
+
+def read_suite(path=SUITE):
+    """
+    yield (fen, expected) for every position of a perft suite file. Each line holds a FEN
+    followed by ';D<depth> <nodes>' operations, expected maps depth to node count.
+    """
+    with open(path) as suite:
+        for line in suite:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(';')
+            expected = {}
+            for operation in fields[1:]:
+                depth, nodes = operation.split()
+                expected[int(depth.lstrip('D'))] = int(nodes)
+            yield fields[0].strip(), expected
+
+
+def perft(board, depth):
+    """count leaf nodes of the legal move tree of board to depth"""
+    if depth == 0:
+        return 1
+    moves = board.legal_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.make_move(move)
+        nodes += perft(board, depth - 1)
+        board.unmake_move()
+    return nodes
+
+
+def divide(board, depth):
+    """return perft count below each legal root move, keyed by the move in UCI notation"""
+    counts = {}
+    for move in board.legal_moves():
+        board.make_move(move)
+        counts[chess.move_to_uci(move)] = perft(board, depth - 1)
+        board.unmake_move()
+    return counts
+
+
+def parallel_divide(board, depth, workers=None):
+    """divide computed by a pool of worker processes, each counting the subtree below a few moves"""
+    workers = workers or parallel.default_workers()
+    plies = parallel.split_plies(board, depth, workers)
+    sequences = [sequence for sequence in parallel.split_moves(board, plies) if sequence]
+    # a sequence is shorter than plies where the game ends, its subtree is counted to the same depth
+    tasks = [(perft, sequence, (depth - len(sequence),)) for sequence in sequences]
+    results = parallel.map_tasks(board, tasks, workers)
+    counts = {}
+    for sequence, nodes in zip(sequences, results):
+        move = chess.move_to_uci(sequence[0])
+        counts[move] = counts.get(move, 0) + nodes
+    return counts
+
+
+def parallel_perft(board, depth, workers=None):
+    """perft computed by a pool of worker processes"""
+    if depth == 0:
+        return 1
+    return sum(parallel_divide(board, depth, workers).values())
+
+
+def run(positions, max_depth, workers=1):
+    """
+    run perft for each (fen, expected) pair at every depth up to max_depth that has an expected
+    count (every depth if expected is empty) and return a list of result dicts. With more than
+    one worker the tree is counted by a process pool.
+    """
+    results = []
+    for fen, expected in positions:
+        with instrument.phase('setup'):
+            board = chess.Board.from_fen(fen)
+        for depth in range(1, max_depth + 1):
+            if expected and depth not in expected:
+                continue
+            start = time.time()
+            with instrument.phase('perft'):
+                nodes = perft(board, depth) if workers <= 1 else parallel_perft(board, depth, workers)
+            seconds = time.time() - start
+            results.append({'fen': fen, 'depth': depth, 'nodes': nodes,
+                            'expected': expected.get(depth), 'seconds': seconds,
+                            'nps': int(nodes / seconds) if seconds > 0 else 0})
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    compare results with the results of an earlier run and return a list of problems:
+    node counts that differ and positions that got slower than the baseline by more than tolerance
+    """
+    problems = []
+    reference = dict(((result['fen'], result['depth']), result) for result in baseline)
+    for result in results:
+        old = reference.get((result['fen'], result['depth']))
+        if old is None:
+            continue
+        if old['nodes'] != result['nodes']:
+            problems.append("%s depth %d: %d nodes, baseline has %d"
+                            % (result['fen'], result['depth'], result['nodes'], old['nodes']))
+        elif old['nps'] and result['nps'] < old['nps'] * (1 - tolerance):
+            problems.append("%s depth %d: %d nps, baseline has %d"
+                            % (result['fen'], result['depth'], result['nps'], old['nps']))
+    return problems
+
+
+def format_result(result):
+    status = 'ok'
+    if result['expected'] is not None and result['expected'] != result['nodes']:
+        status = 'FAIL (expected %d)' % result['expected']
+    return '%-72s %2d %12d %9.3fs %10d nps  %s' % (result['fen'], result['depth'], result['nodes'],
+                                                   result['seconds'], result['nps'], status)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--depth', type=int, default=3, help='maximum depth (default 3)')
+    parser.add_argument('--fen', help='position to count instead of the bundled suite')
+    parser.add_argument('--suite', default=SUITE, help='EPD file with ;D<depth> <nodes> operations')
+    parser.add_argument('--divide', action='store_true', help='print counts per root move of --fen')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to check against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative nps drop against the baseline (default 0.1)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, 0 for one per CPU (default 1)')
+    parser.add_argument('--counters', action='store_true',
+                        help='count calls, cache hits and time per phase, printed as JSON to stderr')
+    parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'],
+                        help='profile the run and print the report to stderr')
+    args = parser.parse_args(argv)
+    workers = args.workers or parallel.default_workers()
+    if args.counters or args.profile:
+        # counters and profilers only see this process
+        workers = 1
+        if args.counters:
+            instrument.counters.reset()
+            instrument.enable()
+        try:
+            with instrument.profiled(args.profile, sys.stderr):
+                return _main(args, workers)
+        finally:
+            if args.counters:
+                instrument.disable()
+                print(instrument.counters.to_json(), file=sys.stderr)
+    return _main(args, workers)
+
+
+def _main(args, workers):
+    if args.divide:
+        board = chess.Board.from_fen(args.fen or chess.STARTING_FEN)
+        with instrument.phase('divide'):
+            counts = divide(board, args.depth) if workers <= 1 else parallel_divide(board, args.depth, workers)
+        if args.json:
+            print(json.dumps(counts, indent=2, sort_keys=True))
+        else:
+            for move in sorted(counts):
+                print('%s: %d' % (move, counts[move]))
+            print('\nNodes searched: %d' % sum(counts.values()))
+        return 0
+
+    positions = [(args.fen, {})] if args.fen else read_suite(args.suite)
+    results = run(positions, args.depth, workers)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(format_result(result))
+    failed = [result for result in results
+              if result['expected'] is not None and result['expected'] != result['nodes']]
+    problems = []
+    if args.baseline:
+        with open(args.baseline) as baseline, instrument.phase('compare'):
+            problems = compare(results, json.load(baseline), args.tolerance)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+    return 1 if failed or problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""
+Read games from PGN files and replay their moves on a Board.
+
+Games are streamed one at a time from plain, gzip (.gz) or zstandard (.zst) compressed files,
+so memory use does not grow with the size of the archive. Moves in standard algebraic
+notation are resolved against the position and played in place on a single reused Board.
+Plain files can be split into byte ranges that a pool of worker processes replays in parallel.
+
+    python pgn.py games.pgn                      replay all games and report games/moves per second
+    python pgn.py games.pgn --workers 0          split the file across one process per CPU
+    python pgn.py games.pgn.zst                  compressed archives are read by a single process
+"""
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import io
+import os
+import re
+import sys
+import time
+
+import chess
+import parallel
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CHUNK_SIZE = 16 << 20
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+TAG_RE = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TAG_BYTES_RE = re.compile(TAG_RE.pattern.encode())
+TOKEN_RE = re.compile(r'\{[^}]*\}?|;[^\n]*|\$\d+|[()]|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s(){};$]+')
+
+Game = namedtuple('Game', ['headers', 'moves', 'result'])
+
+
+def open_pgn(path):
+    """open a PGN file for reading text, decompressing it if the name ends in .gz or .zst"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("reading %s requires the zstandard package" % path)
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def _parse_movetext(headers, movetext):
+    """split movetext into SAN moves of the main line, dropping comments, NAGs and variations"""
+    moves = []
+    result = headers.get('Result', '*')
+    variations = 0
+    for token in TOKEN_RE.findall('\n'.join(movetext)):
+        first = token[0]
+        if first in '{;$' or (first.isdigit() and token[-1] == '.'):
+            continue
+        if token == '(':
+            variations += 1
+        elif token == ')':
+            variations = max(variations - 1, 0)
+        elif variations:
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            moves.append(token)
+    return Game(headers, moves, result)
+
+
+def read_games(source):
+    """
+    yield a Game (headers dict, list of SAN moves, result) for every game of a PGN file.
+    source is a file name or an iterable of lines.
+    """
+    if isinstance(source, str):
+        with open_pgn(source) as lines:
+            for game in read_games(lines):
+                yield game
+        return
+    headers = {}
+    movetext = []
+    comment = False
+    for line in source:
+        line = line.strip()
+        if not comment and line.startswith('['):
+            if movetext:
+                yield _parse_movetext(headers, movetext)
+                headers, movetext = {}, []
+            match = TAG_RE.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+        elif line and (comment or not line.startswith('%')):
+            movetext.append(line)
+            comment = line.count('{') > line.count('}') if not comment else '}' not in line
+    if headers or movetext:
+        yield _parse_movetext(headers, movetext)
+
+
+def replay(game, board=None):
+    """
+    set up the starting position of game on board (a new one if not given), play its moves in
+    place and return them as list of encoded moves. Raises ValueError on an illegal move.
+    """
+    board = board if board is not None else chess.Board()
+    board.set_fen(game.headers.get('FEN', chess.STARTING_FEN))
+    moves = []
+    for san in game.moves:
+        move = board.parse_san(san)
+        board.make_move(move)
+        moves.append(move)
+    return moves
+
+
+def _replay_games(games):
+    """replay games on one board, return (games, moves, games with errors)"""
+    board = chess.Board()
+    count = moves = errors = 0
+    for game in games:
+        count += 1
+        try:
+            moves += len(replay(game, board))
+        except ValueError:
+            errors += 1
+    return count, moves, errors
+
+
+def split_file(path, chunk_size=CHUNK_SIZE):
+    """split a plain PGN file into (start, end) byte ranges of about chunk_size bytes"""
+    size = os.path.getsize(path)
+    return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)] or [(0, 0)]
+
+
+def _line_start(pgn, offset):
+    """offset of the first byte of the line holding byte offset"""
+    while offset > 0:
+        begin = max(0, offset - 4096)
+        pgn.seek(begin)
+        newline = pgn.read(offset - begin).rfind(b'\n')
+        if newline >= 0:
+            return begin + newline + 1
+        offset = begin
+    return 0
+
+
+def read_range(path, start, end):
+    """
+    yield the lines of the games of a plain PGN file that are owned by the byte range
+    [start, end). A game begins with the first tag line after a line that is not a tag and
+    belongs to the range holding the byte before it, so every game is read by exactly one range.
+    Lines in {...} comments are tracked as in read_games. A range cannot know whether it starts
+    inside a comment, so only lines with a complete tag pair can begin a game.
+    """
+    with open(path, 'rb') as pgn:
+        # start at the line holding byte start - 1, it decides whether the next line starts a game
+        position = _line_start(pgn, start - 1) if start else 0
+        pgn.seek(position)
+        previous_tag = False
+        comment = False
+        in_game = False
+        for line in iter(pgn.readline, b''):
+            stripped = line.strip()
+            tag = not comment and TAG_BYTES_RE.match(stripped) is not None
+            if tag and not previous_tag:
+                if position > end:
+                    return
+                in_game = position > start or not start
+            if in_game:
+                yield line.decode('utf-8', 'replace')
+            if not tag and stripped and (comment or not stripped.startswith((b'%', b'['))):
+                comment = stripped.count(b'{') > stripped.count(b'}') if not comment else b'}' not in stripped
+            previous_tag = tag
+            position += len(line)
+
+
+def _replay_range(task):
+    path, start, end = task
+    return _replay_games(read_games(read_range(path, start, end)))
+
+
+def replay_file(path, workers=1, chunk_size=CHUNK_SIZE):
+    """
+    replay every game of a PGN file and return a dict with the number of games, moves, games
+    with illegal moves, seconds and games and moves per second. With more than one worker
+    the byte ranges of a plain file are replayed by a process pool, compressed files are
+    always read by this process.
+    """
+    start = time.time()
+    if workers <= 1 or path.endswith(('.gz', '.zst')):
+        games, moves, errors = _replay_games(read_games(path))
+    else:
+        ranges = split_file(path, chunk_size)
+        with ProcessPoolExecutor(workers) as pool:
+            counts = list(pool.map(_replay_range, [(path, begin, end) for begin, end in ranges]))
+        games, moves, errors = [sum(column) for column in zip(*counts)]
+    seconds = time.time() - start
+    return {'games': games, 'moves': moves, 'errors': errors, 'seconds': seconds,
+            'games_per_second': int(games / seconds) if seconds > 0 else 0,
+            'moves_per_second': int(moves / seconds) if seconds > 0 else 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('path', help='PGN file, optionally compressed as .gz or .zst')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, 0 for one per CPU (default 1)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='bytes of the file per worker task (default %d)' % CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    stats = replay_file(args.path, args.workers or parallel.default_workers(), args.chunk_size)
+    print('%(games)d games, %(moves)d moves, %(errors)d errors in %(seconds).3fs: '
+          '%(games_per_second)d games/s, %(moves_per_second)d moves/s' % stats)
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
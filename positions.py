@@ -0,0 +1,127 @@
+"""
+Append-only database of packed positions in a flat file.
+
+The file starts with a 16 byte header (magic, format version, record size) followed by the
+positions returned by Board.pack, PACKED_SIZE bytes each. Records are read through a read-only
+memory map, so a file with hundreds of millions of positions can be scanned or accessed at
+random without loading it or creating a Python object per position.
+
+    with positions.PositionDatabase('positions.bin') as database:
+        database.append(board)
+        board = database.board(0)
+"""
+import mmap
+import os
+import struct
+
+import chess
+
+
+MAGIC = b'CHESSPOS'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+
+
+class PositionDatabase(object):
+    """
+    PositionDatabase appends packed positions to a file and reads them back by index. The file
+    is created if it does not exist, a database opened with writable=False cannot be appended to.
+    """
+
+    def __init__(self, path, writable=True):
+        self.path = path
+        if writable and not os.path.exists(path):
+            with open(path, 'wb') as database:
+                database.write(HEADER.pack(MAGIC, VERSION, chess.PACKED_SIZE))
+        self.writable = writable
+        self._file = open(path, 'r+b' if writable else 'rb')
+        magic, version, record_size = HEADER.unpack(self._file.read(HEADER.size).ljust(HEADER.size, b'\0'))
+        if magic != MAGIC or version != VERSION or record_size != chess.PACKED_SIZE:
+            self._file.close()
+            raise ValueError("%s is not a position database" % path)
+        size = os.fstat(self._file.fileno()).st_size
+        # a record cut short by an interrupted append is not part of the database
+        self._count = (size - HEADER.size) // chess.PACKED_SIZE
+        self._map = None
+        self._mapped = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, position):
+        """append a Board or a packed position"""
+        self.extend([position])
+
+    def extend(self, positions):
+        """append Boards or packed positions"""
+        if not self.writable:
+            raise ValueError("%s is opened read-only" % self.path)
+        records = []
+        for position in positions:
+            record = position.pack() if isinstance(position, chess.Board) else bytes(position)
+            if len(record) != chess.PACKED_SIZE:
+                raise ValueError("Invalid packed position")
+            records.append(record)
+        self._file.seek(HEADER.size + self._count * chess.PACKED_SIZE)
+        self._file.write(b''.join(records))
+        self._count += len(records)
+
+    def flush(self):
+        """write appended positions to the file, e.g. before it is mapped by another reader"""
+        self._file.flush()
+
+    def _view(self):
+        """memory map covering all records, remapped after appends"""
+        if self._mapped < self._count:
+            self._file.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped = self._count
+        return self._map
+
+    def __getitem__(self, index):
+        """packed position at index"""
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("position index out of range")
+        offset = HEADER.size + index * chess.PACKED_SIZE
+        return self._view()[offset:offset + chess.PACKED_SIZE]
+
+    def __iter__(self):
+        """yield the packed positions in the order they were appended"""
+        count = self._count
+        if not count:
+            return
+        view = self._view()
+        for offset in range(HEADER.size, HEADER.size + count * chess.PACKED_SIZE, chess.PACKED_SIZE):
+            yield view[offset:offset + chess.PACKED_SIZE]
+
+    def board(self, index, board=None):
+        """position at index set up on board, a new one if not given"""
+        board = board if board is not None else chess.Board()
+        board.set_packed(self[index])
+        return board
+
+    def boards(self, board=None):
+        """
+        yield every position as Board. If board is given it is reused for every position, which
+        is faster but the board is only valid until the next position is read.
+        """
+        for record in self:
+            position = board if board is not None else chess.Board()
+            position.set_packed(record)
+            yield position
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,283 @@
+"""
+Alpha-beta search on top of Board.
+
+Searcher runs an iterative deepening negamax search with aspiration windows, a transposition
+table, quiescence search on captures and move ordering by hash move, MVV-LVA, killer moves and
+the history heuristic. Searches can be limited by depth, nodes and time.
+"""
+from collections import namedtuple
+import time
+
+import chess
+import parallel
+import tablebase
+
+
+MATE = 100000
+MATE_BOUND = MATE - 1000
+INFINITY = MATE + 1
+MAX_PLY = 100
+ASPIRATION_WINDOW = 50
+CHECK_EVERY = 1024
+
+SearchResult = namedtuple('SearchResult', ['move', 'score', 'depth', 'nodes', 'seconds', 'pv'])
+
+
+class SearchAborted(Exception):
+    """raised inside the search when a node or time limit is hit or stop() was called"""
+
+
+def _to_table(score, ply):
+    """mate scores are stored relative to the node, not to the root"""
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _from_table(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def _from_tablebase(value, ply):
+    """search score of a tablebase value at ply"""
+    if value > 0:
+        return MATE - ply - (tablebase.TB_MATE - value)
+    if value < 0:
+        return -MATE + ply + (tablebase.TB_MATE + value)
+    return 0
+
+
+def _game_keys(board):
+    """
+    Zobrist keys of the positions played before board since the last capture or pawn move,
+    oldest first, taken back from its move stack so repetitions of the game are seen as draws
+    """
+    keys = []
+    moves = []
+    for _ in range(min(board.halfmove_clock, len(board._stack))):
+        moves.append(board.unmake_move())
+        keys.append(board.zobrist_key)
+    for move in reversed(moves):
+        board.make_move(move)
+    keys.reverse()
+    return keys
+
+
+class Searcher(object):
+    """
+    Searcher keeps the transposition table and the history heuristic between searches, so
+    analysing a sequence of related positions reuses earlier work. With a tablebase, positions
+    it covers are scored by their distance to mate instead of being searched.
+    """
+
+    def __init__(self, table=None, table_mb=16, tablebase=None):
+        self.table = table if table is not None else chess.TranspositionTable(table_mb)
+        self.tablebase = tablebase
+        self.history = [0] * 4096
+        self.stopped = False
+
+    def stop(self):
+        """abort a running search, it returns the result of the last completed iteration"""
+        self.stopped = True
+
+    def search(self, board, depth=MAX_PLY, nodes=None, movetime=None, info=None):
+        """
+        search board and return a SearchResult. depth limits the iterations, nodes the number
+        of visited nodes and movetime the time in seconds. info is called with the result of
+        every completed iteration. The board is left as it was found.
+        """
+        self._prepare(nodes, movetime)
+        self.path = _game_keys(board)
+        stack_size = len(board._stack)
+
+        legal = board.legal_moves()
+        result = SearchResult(legal[0] if legal else 0, 0, 0, 0, 0.0, legal[:1])
+        score = 0
+        for iteration in range(1, max(1, min(depth, MAX_PLY)) + 1):
+            try:
+                score = self._aspiration(board, iteration, score)
+            except SearchAborted:
+                while len(board._stack) > stack_size:
+                    board.unmake_move()
+                break
+            pv = list(self.pv[0])
+            result = SearchResult(pv[0] if pv else result.move, score, iteration, self.nodes,
+                                  time.time() - self.start, pv or result.pv)
+            if info is not None:
+                info(result)
+            if abs(score) > MATE_BOUND and MATE - abs(score) <= iteration:
+                break
+        return result._replace(nodes=self.nodes, seconds=time.time() - self.start)
+
+    def _prepare(self, nodes=None, movetime=None):
+        """reset the per-search state before a new search"""
+        self.stopped = False
+        self.nodes = 0
+        self.node_limit = nodes
+        self.start = time.time()
+        self.deadline = self.start + movetime if movetime is not None else None
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.pv = [[] for _ in range(MAX_PLY + 1)]
+        self.path = []
+        self.history = [value >> 3 for value in self.history]
+        self.table.new_search()
+
+    def _aspiration(self, board, depth, previous):
+        """search with a narrow window around the previous score, widening it on failure"""
+        if depth < 4 or abs(previous) > MATE_BOUND:
+            return self._negamax(board, depth, -INFINITY, INFINITY, 0)
+        delta = ASPIRATION_WINDOW
+        alpha, beta = previous - delta, previous + delta
+        while True:
+            score = self._negamax(board, depth, alpha, beta, 0)
+            if score <= alpha:
+                alpha = max(-INFINITY, alpha - delta)
+            elif score >= beta:
+                beta = min(INFINITY, beta + delta)
+            else:
+                return score
+            delta *= 2
+
+    def _check_limits(self):
+        if (self.stopped or (self.node_limit is not None and self.nodes >= self.node_limit)
+                or (self.deadline is not None and time.time() >= self.deadline)):
+            raise SearchAborted()
+
+    def _negamax(self, board, depth, alpha, beta, ply):
+        self.nodes += 1
+        if not self.nodes % CHECK_EVERY:
+            self._check_limits()
+        self.pv[ply] = []
+        key = board.zobrist_key
+        halfmove_clock = board.halfmove_clock
+        if ply and (halfmove_clock >= 100 or (halfmove_clock and key in self.path[-halfmove_clock:])):
+            return 0
+        if ply and self.tablebase is not None and bin(board.occupied).count('1') <= self.tablebase.max_pieces:
+            value = self.tablebase.probe(board)
+            if value is not None:
+                return _from_tablebase(value, ply)
+        in_check = board.is_check()
+        if in_check:
+            depth += 1
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiescence(board, alpha, beta, ply)
+
+        hash_move = 0
+        entry = self.table.probe(key)
+        if entry is not None:
+            entry_depth, entry_score, bound, hash_move = entry
+            # no cutoffs at PV nodes, they would cut the principal variation short
+            if ply and entry_depth >= depth and beta - alpha == 1:
+                entry_score = _from_table(entry_score, ply)
+                if (bound == chess.TT_EXACT or (bound == chess.TT_LOWER and entry_score >= beta)
+                        or (bound == chess.TT_UPPER and entry_score <= alpha)):
+                    return entry_score
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        legal = 0
+        self.path.append(key)
+        for move in board.generate_staged(hash_move, self.killers[ply], self.history):
+            board.make_move(move)
+            legal += 1
+            if legal == 1:
+                score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            else:
+                score = -self._negamax(board, depth - 1, -alpha - 1, -alpha, ply + 1)
+                if alpha < score < beta:
+                    score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if score >= beta:
+                        if board.is_quiet(move):
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[move & 4095] += depth * depth
+                        break
+        self.path.pop()
+
+        if not legal:
+            return -MATE + ply if in_check else 0
+        if best_score >= beta:
+            bound = chess.TT_LOWER
+        elif best_score > original_alpha:
+            bound = chess.TT_EXACT
+        else:
+            bound = chess.TT_UPPER
+        self.table.store(key, min(depth, 255), _to_table(best_score, ply), bound, best_move)
+        return best_score
+
+    def _quiescence(self, board, alpha, beta, ply):
+        """search captures and promotions only until the position is quiet"""
+        self.nodes += 1
+        if not self.nodes % CHECK_EVERY:
+            self._check_limits()
+        self.pv[ply] = []
+        stand_pat = board.evaluate()
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        for move in board.generate_staged(quiets=False):
+            board.make_move(move)
+            score = -self._quiescence(board, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > alpha:
+                alpha = score
+                self.pv[ply] = [move] + self.pv[ply + 1]
+                if score >= beta:
+                    break
+        return alpha
+
+
+def search(board, depth=MAX_PLY, nodes=None, movetime=None):
+    """search board with a fresh Searcher and return a SearchResult"""
+    return Searcher().search(board, depth, nodes, movetime)
+
+
+def _search_root_move(board, depth):
+    """
+    score of the position reached by a root move, from the point of view of the root, as a
+    search of depth + 1 plies from the root scores it
+    """
+    searcher = Searcher(table_mb=4)
+    if depth == 0:
+        # a search always completes one iteration, score the position as the root's last ply does
+        searcher._prepare()
+        return -searcher._negamax(board, 0, -INFINITY, INFINITY, 1)
+    score = -searcher.search(board, depth).score
+    if score > MATE_BOUND:
+        return score - 1
+    if score < -MATE_BOUND:
+        return score + 1
+    return score
+
+
+def parallel_search(board, depth, workers=None):
+    """
+    fixed depth search whose root moves are searched by a pool of worker processes, each with
+    its own transposition table. Returns (best move, score) or (0, score) if there is no legal move.
+    """
+    moves = board.legal_moves()
+    if not moves:
+        return 0, -MATE if board.is_check() else 0
+    sequences = [(move,) for move in moves]
+    # like the search itself, extend the root by one ply when in check
+    child_depth = max(depth, 1) - 1 + (1 if board.is_check() else 0)
+    scores = parallel.map_moves(board, sequences, _search_root_move, (child_depth,), workers)
+    score, move = max(zip(scores, moves))
+    return move, score
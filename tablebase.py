@@ -0,0 +1,507 @@
+"""
+Endgame tablebases for a king and a few pieces against a lone king, e.g. KQK, KRK, KPK or KBNK.
+
+A table stores the distance to mate of every position of its material, found by retrograde
+analysis: the legal moves of each position are generated with Board, and starting from the
+checkmates, positions are resolved in order of their distance to mate. Positions that are never
+resolved are draws. The side with the pieces is always white inside a table, positions with the
+colors reversed are probed mirrored.
+
+Values are int16 scores from the point of view of the side to move: TB_MATE - n if it mates in
+n plies, -TB_MATE + n if it is mated in n plies and 0 for a draw. Tables are flat files of these
+values behind a small header, indexed by the squares of the pieces and the side to move, and are
+probed through a read-only memory map.
+
+    python tablebase.py KQK KRK KPK --directory tables --workers 0 --verify
+"""
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import os
+import struct
+import sys
+import time
+
+import chess
+import parallel
+
+
+TB_MATE = 32000
+MAGIC = b'CHESSTB1'
+HEADER = struct.Struct('<8s8sII')
+PIECE_ORDER = 'QRBNP'
+CHUNK_SIZE = 4096
+
+# positions of the forward pass
+INVALID, NORMAL, MATED, STALEMATE = range(4)
+NO_VALUE = -TB_MATE - 1
+
+
+def _transforms():
+    """the 8 symmetries of the board as square maps, the identity first"""
+    transforms = []
+    for flip_file in (False, True):
+        for flip_rank in (False, True):
+            for swap in (False, True):
+                squares = []
+                for sq in range(64):
+                    file_idx, rank_idx = sq & 7, sq >> 3
+                    if flip_file:
+                        file_idx = 7 - file_idx
+                    if flip_rank:
+                        rank_idx = 7 - rank_idx
+                    if swap:
+                        file_idx, rank_idx = rank_idx, file_idx
+                    squares.append(rank_idx * 8 + file_idx)
+                transforms.append(squares)
+    return transforms
+
+
+TRANSFORMS = _transforms()
+MIRROR_FILE = [sq ^ 7 for sq in range(64)]
+# the white king is confined to the a1-d1-d4 triangle, or to the a-d files if there are pawns
+TRIANGLE = [sq for sq in range(64) if (sq & 7) <= 3 and (sq >> 3) <= (sq & 7)]
+QUEENSIDE = [sq for sq in range(64) if (sq & 7) <= 3]
+
+
+def signature_of(board):
+    """
+    material signature of a position with a lone king on one side, e.g. 'KRK', the pieces in
+    QRBNP order. Returns (signature, color index of the side with the pieces) or None.
+    """
+    white = board.occupied_co[0] & ~board.bitboards[5]
+    black = board.occupied_co[1] & ~board.bitboards[11]
+    if white and black:
+        return None
+    strong = 1 if black else 0
+    letters = ''
+    for letter in PIECE_ORDER:
+        letters += letter * bin(board.bitboards[strong * 6 + chess.FEN_CODES[letter]]).count('1')
+    return 'K' + letters + 'K', strong
+
+
+def mate_distance(value):
+    """
+    plies to mate of a table value: positive if the side to move mates, 0 or negative if it
+    is mated, None for draws
+    """
+    if value > 0:
+        return TB_MATE - value
+    if value < 0:
+        return -(TB_MATE + value)
+    return None
+
+
+def _parent_value(value):
+    """value of a position whose move leads to a position with value"""
+    if value > 0:
+        return -value + 1
+    if value < 0:
+        return -value - 1
+    return 0
+
+
+class Material(object):
+    """
+    Material maps the positions of a signature to table indices. An index is built from the
+    white king square (one of the squares left after symmetry reduction), the black king and
+    the white pieces in signature order, and the side to move.
+    """
+
+    def __init__(self, signature):
+        letters = signature[1:-1]
+        if (len(signature) < 3 or signature[0] != 'K' or signature[-1] != 'K'
+                or any(letter not in PIECE_ORDER for letter in letters)):
+            raise ValueError("Invalid signature %s" % signature)
+        self.signature = signature
+        self.pieces = [chess.FEN_CODES[letter] for letter in letters]
+        self.pawns = 'P' in letters
+        self.king_squares = QUEENSIDE if self.pawns else TRIANGLE
+        self.king_index = dict((sq, index) for index, sq in enumerate(self.king_squares))
+        self.transforms = [TRANSFORMS[0], MIRROR_FILE] if self.pawns else TRANSFORMS
+        self.size = len(self.king_squares) * 64 ** (1 + len(self.pieces)) * 2
+
+    def index(self, white_king, black_king, squares, turn):
+        """table index of a position with white as the side with the pieces"""
+        king_index = self.king_index
+        for transform in self.transforms:
+            if transform[white_king] in king_index:
+                break
+        index = king_index[transform[white_king]] * 64 + transform[black_king]
+        for sq in squares:
+            index = index * 64 + transform[sq]
+        return index * 2 + turn
+
+    def board_index(self, board, strong=0):
+        """table index of board, strong is the color index of the side with the pieces"""
+        flip = 56 if strong else 0
+        bitboards = board.bitboards
+        base = strong * 6
+        squares = []
+        seen = {}
+        for code in self.pieces:
+            bb = bitboards[base + code] & ~seen.get(code, 0)
+            lsb = bb & -bb
+            seen[code] = seen.get(code, 0) | lsb
+            squares.append((lsb.bit_length() - 1) ^ flip)
+        return self.index((bitboards[base + 5].bit_length() - 1) ^ flip,
+                          (bitboards[6 - base + 5].bit_length() - 1) ^ flip, squares, board.turn ^ strong)
+
+    def decode(self, index):
+        """(white king, black king, squares of the pieces, turn) of index"""
+        turn = index & 1
+        index >>= 1
+        squares = []
+        for _ in self.pieces:
+            squares.append(index & 63)
+            index >>= 6
+        squares.reverse()
+        return self.king_squares[index >> 6], index & 63, squares, turn
+
+    def setup(self, board, index):
+        """set up the position of index on board, return False if the index is no legal position"""
+        white_king, black_king, squares, turn = self.decode(index)
+        occupied = set(squares)
+        occupied.add(white_king)
+        occupied.add(black_king)
+        if len(occupied) != len(squares) + 2:
+            return False
+        board.clear_board()
+        for code, sq in zip(self.pieces, squares):
+            if code == 0 and (sq < 8 or sq >= 56):
+                return False
+            board._put(sq, code)
+        board._put(white_king, 5)
+        board._put(black_king, 11)
+        board.turn = turn
+        # the side that just moved may not be in check
+        return not board.is_attacked(black_king if turn == 0 else white_king, turn)
+
+
+class Tablebase(object):
+    """
+    Tablebase probes the table files of a directory, each table is mapped when it is first
+    needed. Tablebases are pickled by directory, so worker processes map the files themselves.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._tables = {}
+        self.max_pieces = 2
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith('.tb'):
+                    self.max_pieces = max(self.max_pieces, len(name) - 3)
+
+    def __getstate__(self):
+        return self.directory
+
+    def __setstate__(self, directory):
+        self.__init__(directory)
+
+    def path(self, signature):
+        return os.path.join(self.directory, signature + '.tb')
+
+    def _table(self, signature):
+        if signature not in self._tables:
+            table = None
+            path = self.path(signature)
+            if os.path.exists(path):
+                with open(path, 'rb') as tb:
+                    magic, name, count, _ = HEADER.unpack(tb.read(HEADER.size).ljust(HEADER.size, b'\0'))
+                    material = Material(signature)
+                    if magic != MAGIC or name.rstrip(b'\0') != signature.encode() or count != material.size:
+                        raise ValueError("%s is not a %s table" % (path, signature))
+                    table = (material, mmap.mmap(tb.fileno(), 0, access=mmap.ACCESS_READ))
+            self._tables[signature] = table
+        return self._tables[signature]
+
+    def probe(self, board):
+        """
+        table value of board from the point of view of the side to move, None if the position
+        is not covered: too much material, castling rights or a missing table
+        """
+        if board.castling_rights:
+            return None
+        found = signature_of(board)
+        if found is None:
+            return None
+        signature, strong = found
+        if signature in ('KK', 'KBK', 'KNK'):
+            return 0
+        table = self._table(signature)
+        if table is None:
+            return None
+        material, values = table
+        return struct.unpack_from('<h', values, HEADER.size + 2 * material.board_index(board, strong))[0]
+
+    def close(self):
+        for table in self._tables.values():
+            if table is not None:
+                table[1].close()
+        self._tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_material = None
+_tablebase = None
+
+
+def _init_worker(signature, directory):
+    global _material, _tablebase
+    _material = Material(signature)
+    _tablebase = Tablebase(directory)
+
+
+def _external_value(board):
+    """value of a position with different material, reached by a capture or promotion"""
+    value = _tablebase.probe(board)
+    if value is None:
+        raise ValueError("%s needs the %s table" % (_material.signature, signature_of(board)[0]))
+    return value
+
+
+def _forward_chunk(task):
+    """
+    generate the moves of the positions in an index range. Returns the kind of every position,
+    the best value reached through captures and promotions (NO_VALUE if none), the number of
+    distinct successors in the table and the successor indices
+    """
+    start, end = task
+    material = _material
+    board = chess.Board()
+    kinds = bytearray(end - start)
+    external = array('h', [NO_VALUE]) * (end - start)
+    counts = array('H', [0]) * (end - start)
+    successors = array('I')
+    for offset, index in enumerate(range(start, end)):
+        if not material.setup(board, index):
+            continue
+        moves = board.legal_moves()
+        if not moves:
+            kinds[offset] = MATED if board.is_check() else STALEMATE
+            continue
+        kinds[offset] = NORMAL
+        white_king, black_king, squares, turn = material.decode(index)
+        found = set()
+        best = NO_VALUE
+        mailbox = board.mailbox
+        for move in moves:
+            from_sq = move & 63
+            to_sq = move >> 6 & 63
+            if mailbox[to_sq] != chess.NO_PIECE or move >> 12:
+                board.make_move(move)
+                best = max(best, _parent_value(_external_value(board)))
+                board.unmake_move()
+            elif from_sq == white_king:
+                found.add(material.index(to_sq, black_king, squares, turn ^ 1))
+            elif from_sq == black_king:
+                found.add(material.index(white_king, to_sq, squares, turn ^ 1))
+            else:
+                moved = [to_sq if sq == from_sq else sq for sq in squares]
+                found.add(material.index(white_king, black_king, moved, turn ^ 1))
+        external[offset] = best
+        counts[offset] = len(found)
+        successors.extend(sorted(found))
+    return kinds, external, counts, successors
+
+
+def _map_chunks(function, signature, directory, size, workers, args=()):
+    """run function on (start, end) + args of every chunk of the index range, in a pool if workers > 1"""
+    tasks = [(start, min(start + CHUNK_SIZE, size)) + args for start in range(0, size, CHUNK_SIZE)]
+    if workers <= 1:
+        _init_worker(signature, directory)
+        return [function(task) for task in tasks]
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(signature, directory)) as pool:
+        return list(pool.map(function, tasks))
+
+
+def _retrograde(size, kinds, external, counts, successors):
+    """resolve positions in order of their distance to mate, return the values"""
+    offsets = array('I', [0]) * (size + 1)
+    total = 0
+    for index in range(size):
+        offsets[index] = total
+        total += counts[index]
+    offsets[size] = total
+    # predecessors in compressed rows, like the successors
+    predecessor_counts = array('I', [0]) * (size + 1)
+    for successor in successors:
+        predecessor_counts[successor] += 1
+    predecessor_offsets = array('I', [0]) * (size + 1)
+    total = 0
+    for index in range(size):
+        predecessor_offsets[index] = total
+        total += predecessor_counts[index]
+    predecessor_offsets[size] = total
+    predecessors = array('I', [0]) * total
+    fill = array('I', predecessor_offsets)
+    for index in range(size):
+        for position in range(offsets[index], offsets[index + 1]):
+            successor = successors[position]
+            predecessors[fill[successor]] = index
+            fill[successor] += 1
+    del fill
+
+    values = array('h', [0]) * size
+    resolved = bytearray(size)
+    remaining = array('H', counts)
+    buckets = [[]]
+
+    def schedule(index, value):
+        distance = TB_MATE - abs(value)
+        while len(buckets) <= distance:
+            buckets.append([])
+        buckets[distance].append((index, value))
+
+    for index in range(size):
+        kind = kinds[index]
+        if kind == INVALID or kind == STALEMATE:
+            resolved[index] = 1
+        elif kind == MATED:
+            schedule(index, -TB_MATE)
+        elif external[index] > 0:
+            schedule(index, external[index])
+        elif not remaining[index]:
+            if external[index] < 0:
+                schedule(index, external[index])
+            else:
+                resolved[index] = 1
+
+    distance = 0
+    while distance < len(buckets):
+        for index, value in buckets[distance]:
+            if resolved[index]:
+                continue
+            resolved[index] = 1
+            values[index] = value
+            for position in range(predecessor_offsets[index], predecessor_offsets[index + 1]):
+                predecessor = predecessors[position]
+                if resolved[predecessor]:
+                    continue
+                if value < 0:
+                    schedule(predecessor, TB_MATE - distance - 1)
+                    continue
+                remaining[predecessor] -= 1
+                if remaining[predecessor]:
+                    continue
+                best = external[predecessor]
+                if best == 0:
+                    resolved[predecessor] = 1
+                elif best < 0:
+                    # every move loses, the longest way is the best defence
+                    schedule(predecessor, max(-TB_MATE + distance + 1, best))
+                elif best == NO_VALUE:
+                    schedule(predecessor, -TB_MATE + distance + 1)
+        buckets[distance] = None
+        distance += 1
+    return values
+
+
+def write_table(path, signature, values):
+    """write table values to path, through a temporary file so readers never see a partial table"""
+    values = array('h', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as tb:
+        tb.write(HEADER.pack(MAGIC, signature.encode(), len(values), 0))
+        tb.write(values.tobytes())
+    os.replace(temporary, path)
+
+
+def generate(signature, directory, workers=1):
+    """
+    generate the table of signature into directory and return its path. Tables reached by
+    promotions must have been generated before, e.g. KQK and KRK for KPK. The moves of all
+    positions are generated by a pool of worker processes if workers is more than one.
+    """
+    material = Material(signature)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    size = material.size
+    kinds = bytearray()
+    external = array('h')
+    counts = array('H')
+    successors = array('I')
+    for chunk_kinds, chunk_external, chunk_counts, chunk_successors in _map_chunks(
+            _forward_chunk, signature, directory, size, workers):
+        kinds.extend(chunk_kinds)
+        external.extend(chunk_external)
+        counts.extend(chunk_counts)
+        successors.extend(chunk_successors)
+    values = _retrograde(size, kinds, external, counts, successors)
+    path = os.path.join(directory, signature + '.tb')
+    write_table(path, signature, values)
+    return path
+
+
+def _verify_chunk(task):
+    """
+    indices of the range whose value does not follow from the values of their successors. The
+    successors are played and probed like any other position, so this also checks the indexing.
+    """
+    start, end, step = task
+    material = _material
+    board = chess.Board()
+    errors = []
+    for index in range(start - start % -step, end, step):
+        if not material.setup(board, index):
+            continue
+        stored = _tablebase.probe(board)
+        moves = board.legal_moves()
+        if not moves:
+            expected = -TB_MATE if board.is_check() else 0
+        else:
+            expected = NO_VALUE
+            for move in moves:
+                board.make_move(move)
+                expected = max(expected, _parent_value(_external_value(board)))
+                board.unmake_move()
+        if stored != expected:
+            errors.append(index)
+    return errors
+
+
+def verify(signature, directory, workers=1, step=1):
+    """
+    check that the value of every position of a generated table is the best value reachable by
+    its moves and return the indices of the positions that are not. With step only every
+    step-th index is checked.
+    """
+    size = Material(signature).size
+    errors = []
+    for chunk_errors in _map_chunks(_verify_chunk, signature, directory, size, workers, (step,)):
+        errors.extend(chunk_errors)
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('signatures', nargs='+', help='materials to generate in order, e.g. KQK KRK KPK')
+    parser.add_argument('--directory', default='tables', help='directory of the table files (default tables)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, 0 for one per CPU (default 1)')
+    parser.add_argument('--verify', action='store_true', help='check every table after generating it')
+    args = parser.parse_args(argv)
+    workers = args.workers or parallel.default_workers()
+    failed = False
+    for signature in args.signatures:
+        start = time.time()
+        path = generate(signature, args.directory, workers)
+        print('%s: %s in %.1fs' % (signature, path, time.time() - start))
+        if args.verify:
+            errors = verify(signature, args.directory, workers)
+            print('%s: %d inconsistent positions' % (signature, len(errors)))
+            failed = failed or bool(errors)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,25 @@
+import array
+import gzip
+import io
 import itertools
+import json
+import os
+import pickle
+import random
+import shutil
+import tempfile
 import unittest
 
+import batch
+import book
 import chess
+import instrument
+import perft
+import pgn
+import positions
+import search
+import tablebase
+import uci
 
 
 class InitGameTest(unittest.TestCase):
@@ -171,6 +189,1096 @@ class InitGameTest(unittest.TestCase):
         board.set_piece(pawn_white)
         self.assertEqual(true_moves, king_white.valid_moves())
 
+    def test_knight_can_move_from_edge_files(self):
+        board = chess.Board()
+        knight_a = chess.Knight('a', 1, chess.WHITE, board)
+        board.set_piece(knight_a)
+        self.assertEqual(set([('b', 3), ('c', 2)]), knight_a.valid_moves())
+        knight_h = chess.Knight('h', 8, chess.BLACK, board)
+        board.set_piece(knight_h)
+        self.assertEqual(set([('g', 6), ('f', 7)]), knight_h.valid_moves())
+
+    def test_king_can_move_from_edge_files(self):
+        board = chess.Board()
+        king = chess.King('h', 4, chess.WHITE, board)
+        board.set_piece(king)
+        self.assertEqual(set([('h', 3), ('h', 5), ('g', 3), ('g', 4), ('g', 5)]), king.valid_moves())
+        king = chess.King('a', 4, chess.BLACK, board)
+        board.set_piece(king)
+        self.assertEqual(set([('a', 3), ('a', 5), ('b', 3), ('b', 4), ('b', 5)]), king.valid_moves())
+
+
+class BitboardTest(unittest.TestCase):
+
+    def test_square_indexing(self):
+        self.assertEqual(0, chess.square('a', 1))
+        self.assertEqual(63, chess.square('h', 8))
+        self.assertEqual(28, chess.square('e', 4))
+        self.assertEqual('e4', chess.square_name(28))
+        self.assertRaises(ValueError, chess.square, 'i', 1)
+
+    def test_slider_attack_tables_stop_at_blockers(self):
+        occupied = (1 << chess.square('d', 6)) | (1 << chess.square('b', 4)) | (1 << chess.square('f', 6))
+        self.assertEqual(chess.bb_positions(chess.rook_attacks(chess.square('d', 4), occupied)),
+                         set([('d', 5), ('d', 6), ('d', 3), ('d', 2), ('d', 1), ('c', 4), ('b', 4),
+                              ('e', 4), ('f', 4), ('g', 4), ('h', 4)]))
+        self.assertEqual(chess.bb_positions(chess.bishop_attacks(chess.square('d', 4), occupied)),
+                         set([('e', 5), ('f', 6), ('c', 5), ('b', 6), ('a', 7), ('c', 3), ('b', 2),
+                              ('a', 1), ('e', 3), ('f', 2), ('g', 1)]))
+
+    def test_set_piece_updates_bitboards(self):
+        board = chess.Board()
+        board.set_piece(chess.Rook('d', 4, chess.WHITE, board))
+        sq = chess.square('d', 4)
+        self.assertEqual(1 << sq, board.occupied_co[0])
+        self.assertFalse(board.is_empty('d', 4))
+        board.set_piece(chess.Bishop('d', 4, chess.BLACK, board))
+        self.assertEqual(0, board.occupied_co[0])
+        self.assertEqual(1 << sq, board.bitboards[6 + 2])
+        self.assertEqual(1 << sq, board.occupied)
+        self.assertEqual(chess.Bishop('d', 4, chess.BLACK, board), board.get_piece_at_position('d', 4))
+
+    def test_clear_board_removes_pieces(self):
+        board = chess.Board()
+        board.init_pieces()
+        self.assertEqual(32, len(board.pieces))
+        board.clear_board()
+        self.assertEqual(0, board.occupied)
+        self.assertEqual(set(), board.pieces)
+
+
+class MakeMoveTest(unittest.TestCase):
+
+    def snapshot(self, board):
+        return (list(board.bitboards), list(board.mailbox), board.occupied, board.turn,
+                board.castling_rights, board.ep_square, board.halfmove_clock, board.fullmove_number)
+
+    def play(self, board, *moves):
+        for uci in moves:
+            board.make_move(chess.move_from_uci(uci))
+
+    def test_move_uci_roundtrip(self):
+        for uci in ['e2e4', 'g1f3', 'a7a8q', 'h2h1n']:
+            self.assertEqual(uci, chess.move_to_uci(chess.move_from_uci(uci)))
+        self.assertRaises(ValueError, chess.move_from_uci, 'e2e9')
+        self.assertRaises(ValueError, chess.move_from_uci, 'a7a8k')
+
+    def test_make_move_updates_position(self):
+        board = chess.Board()
+        board.init_pieces()
+        self.play(board, 'e2e4')
+        self.assertTrue(board.is_empty('e', 2))
+        self.assertEqual(chess.Pawn('e', 4, chess.WHITE, board), board.get_piece_at_position('e', 4))
+        self.assertEqual(chess.BLACK, board.side_to_move)
+        self.assertEqual(chess.square('e', 3), board.ep_square)
+        self.play(board, 'g8f6')
+        self.assertEqual(None, board.ep_square)
+        self.assertEqual(1, board.halfmove_clock)
+        self.assertEqual(2, board.fullmove_number)
+
+    def test_unmake_move_restores_position(self):
+        board = chess.Board()
+        board.init_pieces()
+        before = self.snapshot(board)
+        moves = ['e2e4', 'd7d5', 'e4d5', 'd8d5', 'b1c3', 'd5a5', 'g1f3', 'c8g4', 'f1e2', 'b8c6', 'e1g1', 'e8c8']
+        self.play(board, *moves)
+        self.assertEqual(chess.King('g', 1, chess.WHITE, board), board.get_piece_at_position('g', 1))
+        self.assertEqual(chess.Rook('f', 1, chess.WHITE, board), board.get_piece_at_position('f', 1))
+        self.assertEqual(chess.King('c', 8, chess.BLACK, board), board.get_piece_at_position('c', 8))
+        self.assertEqual(chess.Rook('d', 8, chess.BLACK, board), board.get_piece_at_position('d', 8))
+        self.assertEqual(0, board.castling_rights)
+        for _ in moves:
+            board.unmake_move()
+        self.assertEqual(before, self.snapshot(board))
+
+    def test_en_passant_and_promotion(self):
+        board = chess.Board()
+        board.set_piece(chess.Pawn('e', 5, chess.WHITE, board))
+        board.set_piece(chess.Pawn('d', 7, chess.BLACK, board))
+        board.set_piece(chess.Pawn('b', 7, chess.WHITE, board))
+        board.turn = 1
+        before = self.snapshot(board)
+        self.play(board, 'd7d5', 'e5d6')
+        self.assertTrue(board.is_empty('d', 5))
+        self.assertEqual(chess.Pawn('d', 6, chess.WHITE, board), board.get_piece_at_position('d', 6))
+        self.play(board, 'd6d5', 'b7b8q')
+        self.assertEqual(chess.Queen('b', 8, chess.WHITE, board), board.get_piece_at_position('b', 8))
+        for _ in range(4):
+            board.unmake_move()
+        self.assertEqual(before, self.snapshot(board))
+
+
+class CopyTest(unittest.TestCase):
+
+    def test_copy_is_independent(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        board.make_move(chess.move_from_uci('e2e4'))
+        copy = board.copy()
+        self.assertEqual(board.to_fen(), copy.to_fen())
+        self.assertEqual(board.zobrist_key, copy.zobrist_key)
+        self.assertEqual(board.evaluate(), copy.evaluate())
+        copy.make_move(chess.move_from_uci('e7e5'))
+        self.assertEqual('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1', board.to_fen())
+        self.assertEqual(sorted(board.legal_moves()), sorted(board.copy(stack=False).legal_moves()))
+        copy.unmake_move()
+        self.assertEqual(chess.move_from_uci('e2e4'), copy.unmake_move())
+        self.assertEqual(chess.STARTING_FEN, copy.to_fen())
+        self.assertRaises(IndexError, board.copy(stack=False).unmake_move)
+
+    def test_shared_tables_and_slots(self):
+        board, other = chess.Board(), chess.Board()
+        self.assertIs(board.files, other.files)
+        self.assertEqual(4, board.file_to_idx('e'))
+        self.assertFalse(hasattr(board, '__dict__'))
+        knight = chess.Knight('b', 1, chess.WHITE)
+        self.assertFalse(hasattr(knight, '__dict__'))
+        self.assertRaises(ValueError, chess.Knight, 'b', 9, chess.WHITE)
+
+    def test_piece_moves_without_board_reference(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        knight = chess.Knight('g', 1, chess.WHITE)
+        self.assertEqual({('f', 3), ('h', 3)}, knight.valid_moves(board))
+        self.assertEqual(knight.valid_moves(board), board.get_piece_at_position('g', 1).valid_moves())
+        self.assertEqual([('e', 3), ('e', 4)], chess.Pawn('e', 2, chess.WHITE).valid_moves(board))
+        self.assertRaises(ValueError, knight.valid_moves)
+
+
+class ZobristTest(unittest.TestCase):
+
+    def play(self, board, *moves):
+        for uci in moves:
+            board.make_move(chess.move_from_uci(uci))
+
+    def test_transpositions_have_equal_keys(self):
+        board_1 = chess.Board()
+        board_1.init_pieces()
+        board_2 = chess.Board()
+        board_2.init_pieces()
+        self.play(board_1, 'g1f3', 'g8f6', 'b1c3')
+        self.play(board_2, 'b1c3', 'g8f6', 'g1f3')
+        self.assertEqual(board_1.zobrist_key, board_2.zobrist_key)
+        board_1.make_move(chess.move_from_uci('b8c6'))
+        self.assertNotEqual(board_1.zobrist_key, board_2.zobrist_key)
+
+    def test_unmake_move_restores_key(self):
+        board = chess.Board()
+        board.init_pieces()
+        key = board.zobrist_key
+        self.play(board, 'e2e4')
+        self.assertNotEqual(key, board.zobrist_key)
+        board.unmake_move()
+        self.assertEqual(key, board.zobrist_key)
+
+    def test_key_depends_on_side_to_move_castling_and_en_passant(self):
+        board = chess.Board()
+        board.init_pieces()
+        key = board.zobrist_key
+        board.turn = 1
+        self.assertNotEqual(key, board.zobrist_key)
+        board.turn = 0
+        board.castling_rights = 0
+        self.assertNotEqual(key, board.zobrist_key)
+        board.castling_rights = chess.CASTLE_ALL
+        board.ep_square = chess.square('e', 3)
+        self.assertNotEqual(key, board.zobrist_key)
+
+    def test_piece_hash_is_stable(self):
+        board = chess.Board()
+        self.assertEqual(chess.ZOBRIST_PIECES[chess.TYPE_IDX[chess.KING]][chess.square('e', 1)],
+                         hash(chess.King('e', 1, chess.WHITE, board)))
+
+
+class TranspositionTableTest(unittest.TestCase):
+
+    def test_store_and_probe(self):
+        table = chess.TranspositionTable(1)
+        self.assertEqual(None, table.probe(12345))
+        table.store(12345, 5, -230, chess.TT_LOWER, 777)
+        self.assertEqual((5, -230, chess.TT_LOWER, 777), table.probe(12345))
+
+    def test_size_follows_memory_budget(self):
+        self.assertEqual(2 * 32768, len(chess.TranspositionTable(1)))
+        self.assertEqual(4 * 32768, len(chess.TranspositionTable(2)))
+
+    def test_depth_preferred_and_always_replace_slots(self):
+        table = chess.TranspositionTable(1)
+        key_1, key_2, key_3 = 7, 7 + (1 << 40), 7 + (2 << 40)
+        table.store(key_1, 8, 10, chess.TT_EXACT)
+        table.store(key_2, 3, 20, chess.TT_EXACT)
+        self.assertEqual(8, table.probe(key_1)[0])
+        self.assertEqual(3, table.probe(key_2)[0])
+        table.store(key_3, 2, 30, chess.TT_EXACT)
+        self.assertEqual(8, table.probe(key_1)[0])
+        self.assertEqual(None, table.probe(key_2))
+        table.new_search()
+        table.store(key_2, 1, 40, chess.TT_UPPER)
+        self.assertEqual(None, table.probe(key_1))
+        self.assertEqual((1, 40, chess.TT_UPPER, 0), table.probe(key_2))
+
+
+class StagedMoveGenerationTest(unittest.TestCase):
+
+    fen = 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1'
+
+    def test_stages_cover_all_moves_once(self):
+        for fen, _ in perft.read_suite():
+            board = chess.Board.from_fen(fen)
+            staged = list(board.generate_staged())
+            self.assertEqual(sorted(board.legal_moves()), sorted(staged))
+            self.assertEqual(len(staged), len(set(staged)))
+
+    def test_stage_order(self):
+        board = chess.Board.from_fen(self.fen)
+        hash_move = chess.move_from_uci('e1g1')
+        killer = chess.move_from_uci('a2a3')
+        moves = list(board.generate_staged(hash_move, [killer, 0]))
+        self.assertEqual(hash_move, moves[0])
+        captures = board.generate_captures()
+        self.assertEqual(set(captures), set(moves[1:1 + len(captures)]))
+        self.assertEqual(killer, moves[1 + len(captures)])
+        self.assertEqual(sorted(board.legal_moves()), sorted(moves))
+        # most valuable victim first: the bishop on a6
+        self.assertEqual('e2a6', chess.move_to_uci(moves[1]))
+
+    def test_captures_only(self):
+        board = chess.Board.from_fen(self.fen)
+        moves = list(board.generate_staged(quiets=False))
+        self.assertEqual(sorted(board.generate_captures()), sorted(moves))
+        self.assertTrue(all(board.mailbox[move >> 6 & 63] != chess.NO_PIECE for move in moves))
+
+    def test_promotion_and_en_passant_order(self):
+        board = chess.Board.from_fen('4k3/1P6/8/8/8/1q6/2P5/4K3 w - - 0 1')
+        moves = [chess.move_to_uci(move) for move in board.generate_staged()]
+        self.assertEqual(['c2b3', 'b7b8q'], moves[:2])
+        self.assertEqual(['b7b8b', 'b7b8n', 'b7b8r'], sorted(moves[-3:]))
+        captures = [chess.move_to_uci(move) for move in board.generate_staged(quiets=False)]
+        self.assertEqual(['c2b3', 'b7b8q'], captures)
+        board = chess.Board.from_fen('4k3/8/8/2rpP3/8/8/8/4K3 w - d6 0 1')
+        board.set_piece(chess.Knight('b', 3, chess.WHITE))
+        moves = [chess.move_to_uci(move) for move in board.generate_staged(quiets=False)]
+        self.assertEqual(['b3c5', 'e5d6'], moves)
+
+    def test_generation_is_lazy(self):
+        board = chess.Board.from_fen(self.fen)
+        moves = board.generate_staged(chess.move_from_uci('e1g1'))
+        self.assertEqual(chess.move_from_uci('e1g1'), next(moves))
+
+    def test_pseudo_legal_check(self):
+        board = chess.Board.from_fen(self.fen)
+        for move in board.generate_moves():
+            self.assertTrue(board.is_pseudo_legal(move), chess.move_to_uci(move))
+        for uci in ['e1e2', 'a1a4', 'e5e6', 'd5d7', 'a2a5', 'e1c2', 'c3e5', 'b4b3', 'a2a3q']:
+            self.assertFalse(board.is_pseudo_legal(chess.move_from_uci(uci)), uci)
+        self.assertFalse(board.is_pseudo_legal(chess.encode_move(chess.square('a', 2), chess.square('a', 3), 5)))
+
+
+class LegalMoveGenerationTest(unittest.TestCase):
+
+    def test_valid_moves_include_captures(self):
+        board = chess.Board()
+        rook = chess.Rook('d', 4, chess.WHITE, board)
+        board.set_piece(rook)
+        board.set_piece(chess.Pawn('d', 6, chess.BLACK, board))
+        board.set_piece(chess.Pawn('f', 4, chess.WHITE, board))
+        self.assertEqual(set([('d', 5), ('d', 6), ('d', 3), ('d', 2), ('d', 1),
+                              ('a', 4), ('b', 4), ('c', 4), ('e', 4)]), rook.valid_moves())
+        pawn = chess.Pawn('e', 5, chess.BLACK, board)
+        board.set_piece(pawn)
+        self.assertEqual([('d', 4), ('f', 4), ('e', 4)], pawn.valid_moves())
+
+    def test_pinned_piece_moves_along_pin(self):
+        board = chess.Board.from_fen('4k3/4r3/8/8/8/4B3/8/4K3 w - - 0 1')
+        self.assertEqual(set(), board.get_piece_at_position('e', 3).valid_moves())
+        board = chess.Board.from_fen('4k3/4r3/8/8/8/8/4R3/4K3 w - - 0 1')
+        self.assertEqual(set([('e', 3), ('e', 4), ('e', 5), ('e', 6), ('e', 7)]),
+                         board.get_piece_at_position('e', 2).valid_moves())
+
+    def test_king_does_not_step_into_check(self):
+        board = chess.Board.from_fen('4k3/8/8/8/8/8/r7/4K3 w - - 0 1')
+        self.assertEqual(set([('d', 1), ('f', 1)]), board.get_piece_at_position('e', 1).valid_moves())
+
+    def test_check_must_be_resolved(self):
+        board = chess.Board.from_fen('4k3/8/8/8/7b/8/3N4/4K2R w - - 0 1')
+        self.assertTrue(board.is_check())
+        moves = set(chess.move_to_uci(move) for move in board.legal_moves())
+        self.assertEqual(set(['e1d1', 'e1f1', 'e1e2', 'h1h4']), moves)
+
+    def test_double_check_allows_only_king_moves(self):
+        board = chess.Board.from_fen('4k3/8/8/8/7b/3n4/3N4/R3K3 w - - 0 1')
+        moves = board.legal_moves()
+        self.assertEqual(set(['e1d1', 'e1e2', 'e1f1']), set(chess.move_to_uci(move) for move in moves))
+
+    def test_en_passant_discovered_check_is_illegal(self):
+        board = chess.Board.from_fen('8/8/8/K2pP2r/8/8/8/7k w - d6 0 1')
+        self.assertNotIn('e5d6', [chess.move_to_uci(move) for move in board.legal_moves()])
+        board = chess.Board.from_fen('8/8/8/3pP3/8/8/8/K6k w - d6 0 1')
+        self.assertIn('e5d6', [chess.move_to_uci(move) for move in board.legal_moves()])
+
+    def test_attack_info_is_cached_until_position_changes(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        info = board.attack_info(0)
+        self.assertIs(info, board.attack_info(0))
+        board.make_move(chess.move_from_uci('e2e4'))
+        self.assertIsNot(info, board.attack_info(0))
+        board.unmake_move()
+        self.assertEqual(info, board.attack_info(0))
+
+    def test_piece_not_on_board(self):
+        board = chess.Board()
+        self.assertRaises(ValueError, chess.Rook('a', 1, chess.WHITE, board).valid_moves)
+
+    def test_moves_from_square_match_legal_moves(self):
+        for fen, _ in perft.read_suite():
+            board = chess.Board.from_fen(fen)
+            for move in board.legal_moves():
+                board.make_move(move)
+                moves = board.legal_moves()
+                for sq in range(64):
+                    if board.mailbox[sq] != chess.NO_PIECE and board.mailbox[sq] // 6 == board.turn:
+                        self.assertEqual(sorted(move for move in moves if move & 63 == sq),
+                                         sorted(board.legal_moves_from(sq)), board.to_fen())
+                board.unmake_move()
+
+
+class EvaluationTest(unittest.TestCase):
+
+    def evaluate_from_scratch(self, board):
+        mg = eg = phase = 0
+        for sq, code in enumerate(board.mailbox):
+            if code != chess.NO_PIECE:
+                mg += chess.MG_TABLE[code][sq]
+                eg += chess.EG_TABLE[code][sq]
+                phase += chess.PHASE_TABLE[code]
+        phase = min(phase, chess.PHASE_TOTAL)
+        score = (mg * phase + eg * (chess.PHASE_TOTAL - phase)) // chess.PHASE_TOTAL
+        return -score if board.turn else score
+
+    def test_start_position_is_balanced(self):
+        board = chess.Board()
+        board.init_pieces()
+        self.assertEqual(0, board.evaluate())
+
+    def test_evaluation_follows_moves(self):
+        board = chess.Board.from_fen('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+        start = board.evaluate()
+        for uci in ['e5f7', 'e8f7', 'e1c1', 'h3g2', 'd5e6', 'g2h1q']:
+            board.make_move(chess.move_from_uci(uci))
+            self.assertEqual(self.evaluate_from_scratch(board), board.evaluate())
+        for _ in range(6):
+            board.unmake_move()
+        self.assertEqual(start, board.evaluate())
+
+    def test_evaluation_is_from_side_to_move(self):
+        board = chess.Board.from_fen('4k3/8/8/8/8/8/8/3QK3 w - - 0 1')
+        self.assertTrue(board.evaluate() > 800)
+        board.turn = 1
+        self.assertTrue(board.evaluate() < -800)
+        board.clear_board()
+        self.assertEqual(0, board.evaluate())
+
+
+class FenTest(unittest.TestCase):
+
+    def test_starting_position(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        reference = chess.Board()
+        reference.init_pieces()
+        self.assertEqual(board.mailbox, reference.mailbox)
+        self.assertEqual(board.bitboards, reference.bitboards)
+        self.assertEqual(board.zobrist_key, reference.zobrist_key)
+        self.assertEqual(board.evaluate(), reference.evaluate())
+        self.assertEqual(board.to_fen(), chess.STARTING_FEN)
+
+    def test_round_trip(self):
+        for fen, _ in perft.read_suite():
+            board = chess.Board.from_fen(fen)
+            self.assertEqual(board.to_fen(), fen + ' 0 1')
+            for move in board.legal_moves():
+                board.make_move(move)
+                self.assertEqual(chess.Board.from_fen(board.to_fen()).zobrist_key, board.zobrist_key)
+                board.unmake_move()
+
+    def test_invalid_fen(self):
+        for fen in ['8/8/8 w - -', 'rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -',
+                    'rnbqkbnr/pppppppx/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -',
+                    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq -',
+                    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e9']:
+            self.assertRaises(ValueError, chess.Board.from_fen, fen)
+
+    def test_read_epd(self):
+        lines = io.StringIO('# comment\n'
+                            '8/8/8/8/8/8/8/K6k w - - bm Ka2; id "test 1";\n'
+                            '\n'
+                            '8/8/8/8/8/8/8/K6k b - - 5 40 ;D1 3\n')
+        positions = chess.read_epd(lines)
+        board, operations = next(positions)
+        self.assertEqual(operations, {'bm': 'Ka2', 'id': 'test 1'})
+        self.assertEqual(board.to_fen(), '8/8/8/8/8/8/8/K6k w - - 0 1')
+        board, operations = next(positions)
+        self.assertEqual(operations, {'D1': '3'})
+        self.assertEqual(board.to_fen(), '8/8/8/8/8/8/8/K6k b - - 5 40')
+        self.assertRaises(StopIteration, next, positions)
+
+    def test_read_epd_reuses_board(self):
+        board = chess.Board()
+        positions = [position for position, _ in chess.read_epd(perft.SUITE, board)]
+        self.assertEqual(len(positions), 7)
+        self.assertTrue(all(position is board for position in positions))
+
+
+class PackTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for fen, _ in perft.read_suite():
+            board = chess.Board.from_fen(fen)
+            for move in board.legal_moves():
+                board.make_move(move)
+                packed = board.pack()
+                self.assertEqual(len(packed), chess.PACKED_SIZE)
+                unpacked = chess.Board.unpack(packed)
+                self.assertEqual(unpacked.to_fen(), board.to_fen())
+                self.assertEqual(unpacked.mailbox, board.mailbox)
+                self.assertEqual(unpacked.zobrist_key, board.zobrist_key)
+                self.assertEqual(unpacked.evaluate(), board.evaluate())
+                board.unmake_move()
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, chess.Board.unpack, b'\0' * (chess.PACKED_SIZE - 1))
+        packed = bytearray(chess.Board.from_fen('8/8/8/8/8/8/8/K6k w - - 0 1').pack())
+        packed[8] = 0xFF
+        self.assertRaises(ValueError, chess.Board.unpack, bytes(packed))
+
+
+class PositionDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'positions.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_read(self):
+        fens = [fen + ' 0 1' for fen, _ in perft.read_suite()]
+        with positions.PositionDatabase(self.path) as database:
+            database.append(chess.Board.from_fen(fens[0]))
+            self.assertEqual(database.board(0).to_fen(), fens[0])
+            database.extend(chess.Board.from_fen(fen).pack() for fen in fens[1:])
+            self.assertEqual(len(database), len(fens))
+            self.assertEqual(database.board(-1).to_fen(), fens[-1])
+        with positions.PositionDatabase(self.path, writable=False) as database:
+            self.assertEqual(len(database), len(fens))
+            self.assertEqual([chess.Board.unpack(record).to_fen() for record in database], fens)
+            board = chess.Board()
+            self.assertEqual([position.to_fen() for position in database.boards(board)], fens)
+            self.assertIs(database.board(3, board), board)
+            self.assertRaises(IndexError, database.__getitem__, len(fens))
+            self.assertRaises(ValueError, database.append, board)
+
+    def test_truncated_record_is_ignored(self):
+        with positions.PositionDatabase(self.path) as database:
+            database.append(chess.Board.from_fen(chess.STARTING_FEN))
+        with open(self.path, 'ab') as database:
+            database.write(b'\0' * 5)
+        with positions.PositionDatabase(self.path) as database:
+            self.assertEqual(len(database), 1)
+            database.append(chess.Board.from_fen(chess.STARTING_FEN))
+            self.assertEqual([position.to_fen() for position in database.boards()], [chess.STARTING_FEN] * 2)
+
+    def test_not_a_database(self):
+        with open(self.path, 'wb') as other:
+            other.write(b'not a position database')
+        self.assertRaises(ValueError, positions.PositionDatabase, self.path)
+
+
+class BatchWithoutNumpyTest(unittest.TestCase):
+
+    def test_functions_require_numpy(self):
+        np, batch.np = batch.np, None
+        try:
+            for function in [batch.from_boards, batch.records, batch.turns, batch.from_packed, batch.to_planes,
+                             batch.popcount, batch.material, batch.evaluate, batch.mobility]:
+                self.assertRaises(ImportError, function, [])
+            self.assertRaises(ImportError, batch.attacks, [], 0)
+        finally:
+            batch.np = np
+
+
+@unittest.skipIf(batch.np is None, 'numpy is not installed')
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.boards = []
+        for fen, _ in perft.read_suite():
+            board = chess.Board.from_fen(fen)
+            for move in board.legal_moves():
+                board.make_move(move)
+                self.boards.append(chess.Board.from_fen(board.to_fen()))
+                board.unmake_move()
+
+    def mobility(self, board):
+        """mobility computed square by square with the attack tables"""
+        score = 0
+        for color, sign in [(0, 1), (1, -1)]:
+            attacked = 0
+            for piece_type in (1, 2, 3, 4):
+                for sq in range(64):
+                    if board.mailbox[sq] == color * 6 + piece_type:
+                        attacked |= chess.piece_attacks(piece_type, sq, board.occupied)
+            score += sign * bin(attacked & ~board.occupied_co[color]).count('1')
+        return score
+
+    def test_packed_positions_match_boards(self):
+        bitboards = batch.from_boards(self.boards)
+        self.assertEqual(bitboards.shape, (len(self.boards), 12))
+        packed = b''.join(board.pack() for board in self.boards)
+        self.assertTrue((batch.from_packed(packed) == bitboards).all())
+        self.assertEqual(list(batch.turns(packed)), [board.turn for board in self.boards])
+
+    def test_planes(self):
+        planes = batch.to_planes(batch.from_boards(self.boards[:5]))
+        self.assertEqual(planes.shape, (5, 12, 8, 8))
+        for board, board_planes in zip(self.boards, planes):
+            for sq in range(64):
+                code = board.mailbox[sq]
+                self.assertEqual(list(board_planes[:, sq >> 3, sq & 7]), [int(code == index) for index in range(12)])
+
+    def test_evaluation(self):
+        bitboards = batch.from_boards(self.boards)
+        turns = [board.turn for board in self.boards]
+        self.assertEqual(list(batch.evaluate(bitboards, turns)), [board.evaluate() for board in self.boards])
+        self.assertEqual(list(batch.material(batch.from_boards([chess.Board.from_fen('4k3/8/8/8/8/8/8/RN2K3 w - - 0 1')]))),
+                         [chess.MG_VALUES[1] + chess.MG_VALUES[3]])
+        self.assertEqual(list(batch.mobility(bitboards)), [self.mobility(board) for board in self.boards])
+
+    def test_load_database(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with positions.PositionDatabase(os.path.join(directory, 'positions.bin')) as database:
+                self.assertEqual(len(batch.load(database)), 0)
+                database.extend(self.boards)
+                packed = batch.load(database)
+                self.assertEqual(len(packed), len(self.boards))
+                self.assertTrue((batch.from_packed(packed) == batch.from_boards(self.boards)).all())
+                del packed
+        finally:
+            shutil.rmtree(directory)
+
+
+class OpeningBookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'book.bin')
+        start = chess.Board.from_fen(chess.STARTING_FEN)
+        castling = chess.Board.from_fen('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+        # Polyglot moves: to file, to row, from file and from row in 3 bits each
+        entries = [(book.polyglot_key(start), 12 << 6 | 28, 10, 0),
+                   (book.polyglot_key(start), 11 << 6 | 27, 30, 0),
+                   (book.polyglot_key(start), 6 << 6 | 21, 0, 0),
+                   (book.polyglot_key(castling), 4 << 6 | 7, 1, 0),
+                   (book.polyglot_key(castling), 4 << 6 | 0, 1, 0)]
+        rng = random.Random(1)
+        entries.extend((rng.getrandbits(64), 0, 1, 0) for _ in range(1000))
+        with open(self.path, 'wb') as polyglot:
+            polyglot.write(b''.join(book.ENTRY.pack(*entry) for entry in sorted(entries, key=lambda entry: entry[0])))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_polyglot_keys(self):
+        # keys published with the Polyglot book format
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        self.assertEqual(book.polyglot_key(board), 0x463b96181691fc9c)
+        for uci, key in [('e2e4', 0x823c9b50fd114196), ('d7d5', 0x0756b94461c50fb0),
+                         ('e4e5', 0x662fafb965db29d4), ('f7f5', 0x22a48b5a8e47ff78),
+                         ('e1e2', 0x652a607ca3f242c1), ('e8f7', 0x00fdd303c946bdd9)]:
+            board.make_move(chess.move_from_uci(uci))
+            self.assertEqual(book.polyglot_key(board), key)
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        for uci in ['a2a4', 'b7b5', 'h2h4', 'b5b4', 'c2c4']:
+            board.make_move(chess.move_from_uci(uci))
+        self.assertEqual(book.polyglot_key(board), 0x3c8123ea7b067637)
+
+    def test_probe(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        with book.OpeningBook(self.path) as opening_book:
+            self.assertEqual(len(opening_book), 1005)
+            moves = [(chess.move_to_uci(entry.move), entry.weight) for entry in opening_book.entries(board)]
+            self.assertEqual(sorted(moves), [('d2d4', 30), ('e2e4', 10), ('g1f3', 0)])
+            self.assertEqual(opening_book.best_move(board), chess.move_from_uci('d2d4'))
+            rng = random.Random(0)
+            picks = [chess.move_to_uci(opening_book.weighted_choice(board, rng)) for _ in range(400)]
+            self.assertEqual(set(picks), set(['d2d4', 'e2e4']))
+            self.assertTrue(picks.count('d2d4') > picks.count('e2e4'))
+            board.make_move(chess.move_from_uci('e2e4'))
+            self.assertEqual(opening_book.entries(board), [])
+            self.assertEqual(opening_book.best_move(board), 0)
+            self.assertEqual(opening_book.weighted_choice(board), 0)
+
+    def test_castling_moves(self):
+        board = chess.Board.from_fen('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+        with book.OpeningBook(self.path) as opening_book:
+            moves = sorted(chess.move_to_uci(entry.move) for entry in opening_book.entries(board))
+            self.assertEqual(moves, ['e1c1', 'e1g1'])
+            self.assertEqual(len(pickle.loads(pickle.dumps(opening_book)).entries(board)), 2)
+
+    def test_not_a_book(self):
+        with open(self.path, 'ab') as polyglot:
+            polyglot.write(b'\0')
+        self.assertRaises(ValueError, book.OpeningBook, self.path)
+
+
+class TablebaseTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        tablebase.generate('KQK', cls.directory)
+        tablebase.generate('KRK', cls.directory, workers=2)
+        cls.tablebase = tablebase.Tablebase(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tablebase.close()
+        shutil.rmtree(cls.directory)
+
+    def probe(self, fen):
+        return tablebase.mate_distance(self.tablebase.probe(chess.Board.from_fen(fen)))
+
+    def test_longest_mates(self):
+        # the longest mates are 10 moves with the queen and 16 with the rook
+        for signature, plies in [('KQK', 19), ('KRK', 31)]:
+            with open(self.tablebase.path(signature), 'rb') as table:
+                values = array.array('h', table.read()[tablebase.HEADER.size:])
+            self.assertEqual(max(tablebase.mate_distance(value) for value in values if value > 0), plies)
+
+    def test_probe(self):
+        self.assertEqual(self.probe('k7/8/1K6/8/8/8/8/7R w - - 0 1'), 1)
+        self.assertEqual(self.probe('k7/1R6/1K6/8/8/8/8/8 b - - 0 1'), None)
+        self.assertEqual(self.probe('k6R/8/1K6/8/8/8/8/8 b - - 0 1'), 0)
+        self.assertEqual(self.probe('8/8/8/8/8/8/8/KQ5k b - - 0 1'), -16)
+        self.assertEqual(self.probe('8/8/8/8/1k6/8/1r6/K7 w - - 0 1'), None)
+        # colors reversed and mirrored positions have the same value
+        self.assertEqual(self.probe('8/8/8/4k3/8/8/8/4K2R b - - 0 1'), self.probe('4k2r/8/8/8/4K3/8/8/8 w - - 0 1'))
+        self.assertEqual(self.probe('8/8/8/4k3/8/8/8/4K2R b - - 0 1'), self.probe('8/8/8/3k4/8/8/8/R2K4 b - - 0 1'))
+        self.assertEqual(self.tablebase.probe(chess.Board.from_fen('8/8/8/4k3/8/8/8/4KB2 w - - 0 1')), 0)
+        self.assertEqual(self.tablebase.probe(chess.Board.from_fen('8/8/8/4k3/8/8/8/4K2R w K - 0 1')), None)
+        self.assertEqual(self.tablebase.probe(chess.Board.from_fen('8/8/8/4k3/8/8/8/3QK2R w - - 0 1')), None)
+
+    def test_tables_are_consistent(self):
+        self.assertEqual(tablebase.verify('KQK', self.directory, step=17), [])
+        self.assertEqual(tablebase.verify('KRK', self.directory, workers=2, step=17), [])
+
+    def test_search_uses_tablebase(self):
+        board = chess.Board.from_fen('8/8/8/4k3/8/8/8/4K2R w - - 0 1')
+        result = search.Searcher(tablebase=self.tablebase).search(board, depth=3)
+        self.assertEqual(search.MATE - result.score, self.probe('8/8/8/4k3/8/8/8/4K2R w - - 0 1'))
+        board.make_move(result.move)
+        self.assertEqual(self.probe(board.to_fen()), -(search.MATE - result.score - 1))
+
+
+class UciTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = []
+        self.engine = uci.Engine(self.lines.append)
+
+    def wait(self):
+        self.engine.thread.join(30)
+        self.assertFalse(self.engine.thread.is_alive())
+
+    def test_handshake(self):
+        self.engine.handle('uci')
+        self.engine.handle('isready')
+        self.assertEqual(self.lines[0], 'id name chess')
+        self.assertEqual(self.lines[-2:], ['uciok', 'readyok'])
+
+    def test_go_depth(self):
+        self.engine.handle('position startpos moves e2e4 e7e5')
+        self.assertEqual(self.engine.board.to_fen(), 'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2')
+        self.engine.handle('go depth 3')
+        self.wait()
+        infos = [line for line in self.lines if line.startswith('info')]
+        self.assertEqual([info.split()[2] for info in infos], ['1', '2', '3'])
+        for field in ['score', 'nodes', 'nps', 'pv']:
+            self.assertIn(' %s ' % field, infos[-1])
+        bestmove = self.lines[-1].split()
+        self.assertEqual(bestmove[0], 'bestmove')
+        self.assertIn(chess.move_from_uci(bestmove[1]), self.engine.board.legal_moves())
+
+    def test_search_sees_game_repetitions(self):
+        self.engine.handle('position fen rnb1kbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1 moves g1f3 g8f6 f3g1')
+        self.engine.handle('go depth 3')
+        self.wait()
+        self.assertEqual('bestmove f6g8', self.lines[-1].split(' ponder')[0])
+
+    def test_mate_score(self):
+        self.engine.handle('position fen r2qkb1r/pp2nppp/3p4/2pNN1B1/2BnP3/3P4/PPP2PPP/R2bK2R w KQkq - 1 1')
+        self.engine.handle('go depth 4')
+        self.wait()
+        self.assertIn('score mate 2', self.lines[-2])
+        self.assertEqual(uci.format_score(-search.MATE + 4), 'mate -2')
+
+    def test_stop_infinite_search(self):
+        self.engine.handle('position startpos')
+        self.engine.handle('go infinite')
+        self.engine.handle('isready')
+        self.assertEqual(self.lines[-1], 'readyok')
+        self.engine.handle('stop')
+        self.assertIsNone(self.engine.thread)
+        self.assertTrue(self.lines[-1].startswith('bestmove '))
+
+    def test_ponderhit(self):
+        self.engine.handle('position startpos')
+        self.engine.handle('go ponder wtime 1000 btime 1000')
+        self.engine.handle('ponderhit')
+        thread = self.engine.thread
+        thread.join(30)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(self.lines[-1].startswith('bestmove '))
+
+    def test_allocate_time(self):
+        self.assertAlmostEqual(uci.allocate_time(60.0), 60.0 / 30 - uci.MOVE_OVERHEAD)
+        self.assertAlmostEqual(uci.allocate_time(60.0, 2.0, 10), 6.0 + 1.5 - uci.MOVE_OVERHEAD)
+        self.assertAlmostEqual(uci.allocate_time(1.0, 0.0, 1), 0.5 - uci.MOVE_OVERHEAD)
+        self.assertEqual(uci.allocate_time(0.01), 0.01)
+
+    def test_main(self):
+        output = io.StringIO()
+        uci.main(io.StringIO('uci\nposition startpos moves e2e4 e7e4\ngo depth 1\nisready\nquit\n'), output)
+        lines = output.getvalue().splitlines()
+        self.assertIn('uciok', lines)
+        self.assertIn('info string Illegal move e7e4', lines)
+        self.assertIn('readyok', lines)
+        self.assertTrue(any(line.startswith('bestmove ') for line in lines))
+
+    def test_errors_are_reported(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'KQK.tb'), 'wb') as corrupt:
+            corrupt.write(b'not a table')
+        output = io.StringIO()
+        uci.main(io.StringIO('setoption name BookFile value %s\nsetoption name TablebasePath value %s\n'
+                             'position fen 8/8/8/4k3/8/8/8/3QK3 w - - 0 1\ngo depth 2\nisready\nquit\n'
+                             % (os.path.join(directory, 'missing.bin'), directory)), output)
+        lines = output.getvalue().splitlines()
+        self.assertTrue(any(line.startswith('info string') and 'missing.bin' in line for line in lines))
+        self.assertTrue(any(line.startswith('info string search failed') for line in lines))
+        bestmove = [line for line in lines if line.startswith('bestmove ')]
+        self.assertEqual(1, len(bestmove))
+        self.assertNotEqual('bestmove 0000', bestmove[0])
+
+
+OPERA_GAME = """[Event "Paris"]
+[White "Paul Morphy"]
+[Black "Duke Karl / Count Isouard"]
+[Result "1-0"]
+
+1.e4 e5 2.Nf3 d6 3.d4 Bg4 {This is a weak move
+already.} 4.dxe5 Bxf3 (4...dxe5 5.Qxd8+ Kxd8 6.Nxe5) 5.Qxf3 dxe5 6.Bc4 Nf6 7.Qb3 Qe7
+8.Nc3 c6 9.Bg5 b5?! 10.Nxb5 cxb5 11.Bxb5+ Nbd7 12.O-O-O Rd8 13.Rxd7 Rxd7 $1
+14.Rd1 Qe6 15.Bxd7+ Nxd7 16.Qb8+ Nxb8 17.Rd8# 1-0
+
+[Event "Promotion"]
+[FEN "8/P6k/8/8/8/8/8/K7 w - - 0 1"]
+[Result "*"]
+
+1. a8=Q Kg6 2. Qb8 *
+"""
+
+
+class PgnTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'games.pgn')
+        with open(self.path, 'w') as games:
+            games.write((OPERA_GAME + '\n') * 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_san(self):
+        board = chess.Board.from_fen('r3k2r/1P6/8/3pP3/8/2N3N1/8/R3K2R w KQkq d6 0 1')
+        for san, uci in [('Nce4', 'c3e4'), ('Nc3e4', 'c3e4'), ('Nge4', 'g3e4'), ('exd6', 'e5d6'),
+                         ('b8=Q', 'b7b8q'), ('bxa8=N+', 'b7a8n'), ('O-O', 'e1g1'), ('O-O-O+', 'e1c1'),
+                         ('Rxa8+', 'a1a8'), ('Kd2', 'e1d2')]:
+            self.assertEqual(board.parse_san(san), chess.move_from_uci(uci))
+        for san in ['Ne4', 'N3e4', 'Nf6', 'b8', 'Kf3', 'exd5', 'Zf3', '']:
+            self.assertRaises(ValueError, board.parse_san, san)
+
+    def test_parse_san_pinned_piece(self):
+        board = chess.Board.from_fen('4k3/8/8/8/4r3/8/2N1N3/4K3 w - - 0 1')
+        self.assertEqual(board.parse_san('Nd4'), chess.move_from_uci('c2d4'))
+        self.assertRaises(ValueError, board.parse_san, 'Nf4')
+
+    def test_read_games(self):
+        games = list(pgn.read_games(io.StringIO(OPERA_GAME)))
+        self.assertEqual(len(games), 2)
+        self.assertEqual(games[0].headers['White'], 'Paul Morphy')
+        self.assertEqual(games[0].result, '1-0')
+        self.assertEqual(len(games[0].moves), 33)
+        self.assertEqual(games[0].moves[:3], ['e4', 'e5', 'Nf3'])
+        self.assertEqual(games[1].moves, ['a8=Q', 'Kg6', 'Qb8'])
+
+    def test_replay(self):
+        board = chess.Board()
+        opera, promotion = pgn.read_games(io.StringIO(OPERA_GAME))
+        self.assertEqual(len(pgn.replay(opera, board)), 33)
+        self.assertEqual(board.to_fen(), '1n1Rkb1r/p4ppp/4q3/4p1B1/4P3/8/PPP2PPP/2K5 b k - 1 17')
+        self.assertEqual(board.legal_moves(), [])
+        pgn.replay(promotion, board)
+        self.assertEqual(board.to_fen(), '1Q6/8/6k1/8/8/8/8/K7 b - - 2 2')
+
+    def test_ranges_read_every_game_once(self):
+        crlf = os.path.join(self.directory, 'crlf.pgn')
+        with open(crlf, 'wb') as games:
+            games.write(((OPERA_GAME + '\n') * 20).replace('\n', '\r\n').encode())
+        compact = os.path.join(self.directory, 'compact.pgn')
+        with open(compact, 'w') as games:
+            games.write(OPERA_GAME.replace('\n\n[', '\n[') * 20)
+        commented_game = OPERA_GAME.replace('a8=Q Kg6', 'a8=Q {a comment\n[%eval 0.3]\n[see note]} Kg6')
+        commented = os.path.join(self.directory, 'commented.pgn')
+        with open(commented, 'w') as games:
+            games.write((commented_game + '\n') * 20)
+        commented_compact = os.path.join(self.directory, 'commented_compact.pgn')
+        with open(commented_compact, 'w') as games:
+            games.write(commented_game.replace('\n\n[', '\n[') * 20)
+        for path in [self.path, crlf, compact, commented, commented_compact]:
+            expected = list(pgn.read_games(path))
+            self.assertEqual(len(expected), 40)
+            self.assertEqual(expected[1].moves, ['a8=Q', 'Kg6', 'Qb8'])
+            for chunk_size in [1, 5, 7, 17, 31, 64, 100, 333, 4096] + list(range(500, 700, 13)):
+                games = []
+                for start, end in pgn.split_file(path, chunk_size):
+                    games.extend(pgn.read_games(pgn.read_range(path, start, end)))
+                self.assertEqual(games, expected)
+
+    def test_replay_file(self):
+        with open(self.path, 'rb') as plain, gzip.open(self.path + '.gz', 'wb') as compressed:
+            shutil.copyfileobj(plain, compressed)
+        for path, workers in [(self.path, 1), (self.path, 2), (self.path + '.gz', 1)]:
+            stats = pgn.replay_file(path, workers, chunk_size=500)
+            self.assertEqual((stats['games'], stats['moves'], stats['errors']), (40, 720, 0))
+
+    @unittest.skipIf(pgn.zstandard is None, 'zstandard is not installed')
+    def test_zstandard(self):
+        with open(self.path, 'rb') as plain, open(self.path + '.zst', 'wb') as compressed:
+            compressed.write(pgn.zstandard.ZstdCompressor().compress(plain.read()))
+        self.assertEqual(len(list(pgn.read_games(self.path + '.zst'))), 40)
+
+
+class InstrumentTest(unittest.TestCase):
+
+    def tearDown(self):
+        instrument.disable()
+
+    def test_counts(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        with instrument.instrumented() as counters:
+            self.assertEqual(perft.perft(board, 2), 400)
+            board.get_piece_at_position('e', 2).valid_moves()
+            board.get_piece_at_position('g', 1).valid_moves()
+            board.legal_moves_from(chess.square('e', 2))
+        snapshot = counters.snapshot()
+        self.assertEqual(snapshot['calls']['Board.make_move'], 20)
+        # perft to depth 2 generates 16 pawn and 4 knight moves in 21 positions, plus the moves of
+        # the e2 pawn, looked up twice
+        self.assertEqual(snapshot['calls']['generated.P'], 16 * 21 + 2 * 2)
+        self.assertEqual(snapshot['calls']['generated.N'], 4 * 21)
+        self.assertEqual(snapshot['calls']['Pawn.valid_moves'], 1)
+        self.assertEqual(snapshot['calls']['Knight.valid_moves'], 1)
+        self.assertEqual(snapshot['calls']['Board.legal_moves_from.P'], 2)
+        self.assertEqual(snapshot['calls']['Board.legal_moves_from.N'], 1)
+        self.assertGreaterEqual(snapshot['squares_probed'], 2)
+        self.assertGreater(snapshot['cache']['attack_info']['hits'], 0)
+        self.assertGreater(snapshot['seconds']['Board.legal_moves'], 0)
+        self.assertEqual(json.loads(counters.to_json()), json.loads(json.dumps(snapshot)))
+
+    def test_squares_probed_once(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        with instrument.instrumented() as counters:
+            board.get_piece_at_position('e', 2)
+            board.is_empty('e', 4)
+        self.assertEqual(2, counters.snapshot()['squares_probed'])
+
+    def test_disabled(self):
+        original = chess.Board.__dict__['make_move']
+        with instrument.instrumented() as counters:
+            self.assertIsNot(chess.Board.__dict__['make_move'], original)
+        self.assertIs(chess.Board.__dict__['make_move'], original)
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        perft.perft(board, 2)
+        self.assertNotIn('Board.make_move', counters.calls)
+
+    def test_copies_are_created_positions(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        with instrument.instrumented() as counters:
+            board.copy()
+            chess.Board()
+        self.assertEqual(2, counters.calls['Board.created'])
+
+    def test_phases(self):
+        with instrument.phase('disabled'):
+            pass
+        with instrument.instrumented() as counters:
+            perft.run([(chess.STARTING_FEN, {})], 2)
+        self.assertNotIn('disabled', counters.seconds)
+        self.assertGreater(counters.seconds['perft'], 0)
+        self.assertIn('setup', counters.snapshot()['seconds'])
+
+    def test_table_probe(self):
+        searcher = search.Searcher()
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        with instrument.instrumented() as counters:
+            searcher.search(board, 3)
+        cache = counters.snapshot()['cache']['transposition_table']
+        self.assertGreater(cache['hits'] + cache['misses'], 0)
+        self.assertEqual(counters.calls['Searcher.search'], 1)
+
+    def test_profile(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        for kind in ['cprofile', 'tracemalloc']:
+            stream = io.StringIO()
+            with instrument.profiled(kind, stream):
+                perft.perft(board, 2)
+            self.assertTrue(stream.getvalue())
+        with self.assertRaises(ValueError):
+            with instrument.profiled('timeit', stream):
+                pass
+
+
+class PerftTest(unittest.TestCase):
+
+    def test_suite_node_counts(self):
+        for fen, expected in perft.read_suite():
+            board = chess.Board.from_fen(fen)
+            for depth in (1, 2):
+                self.assertEqual(expected[depth], perft.perft(board, depth), fen)
+
+    def test_perft_leaves_board_unchanged(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        key = board.zobrist_key
+        self.assertEqual(8902, perft.perft(board, 3))
+        self.assertEqual(key, board.zobrist_key)
+
+    def test_divide(self):
+        counts = perft.divide(chess.Board.from_fen(chess.STARTING_FEN), 2)
+        self.assertEqual(20, len(counts))
+        self.assertEqual(20, counts['e2e4'])
+        self.assertEqual(400, sum(counts.values()))
+
+    def test_compare_with_baseline(self):
+        results = perft.run([(chess.STARTING_FEN, {1: 20, 2: 400})], 2)
+        self.assertEqual([], perft.compare(results, results))
+        slower = [dict(result, nps=result['nps'] * 2) for result in results]
+        self.assertEqual(2, len(perft.compare(results, slower)))
+        wrong = [dict(result, nodes=result['nodes'] + 1) for result in results]
+        self.assertEqual(2, len(perft.compare(results, wrong)))
+
+
+class ParallelTest(unittest.TestCase):
+
+    def test_pickled_board_is_compact_and_restores_position(self):
+        board = chess.Board.from_fen('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+        board.make_move(chess.move_from_uci('a2a4'))
+        data = pickle.dumps(board)
+        self.assertNotIn(b'Pawn', data)
+        copy = pickle.loads(data)
+        self.assertEqual(board.zobrist_key, copy.zobrist_key)
+        self.assertEqual(board.mailbox, copy.mailbox)
+        self.assertEqual(chess.square('a', 3), copy.ep_square)
+
+    def test_parallel_divide_matches_divide(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        self.assertEqual(perft.divide(board, 3), perft.parallel_divide(board, 3, workers=2))
+        self.assertEqual(8902, perft.parallel_perft(board, 3, workers=2))
+
+    def test_parallel_divide_with_game_ending_root_moves(self):
+        board = chess.Board.from_fen('k7/8/1K6/8/8/8/8/7R w - - 0 1')
+        counts = perft.parallel_divide(board, 2, workers=8)
+        self.assertEqual(perft.divide(board, 2), counts)
+        self.assertEqual(0, counts['h1h8'])
+        self.assertEqual(26, sum(counts.values()))
+
+
+class SearchTest(unittest.TestCase):
+
+    def test_finds_mate_in_one(self):
+        board = chess.Board.from_fen('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1')
+        result = search.search(board, depth=3)
+        self.assertEqual('a1a8', chess.move_to_uci(result.move))
+        self.assertEqual(search.MATE - 1, result.score)
+
+    def test_finds_mate_in_two(self):
+        board = chess.Board.from_fen('r2qkb1r/pp2nppp/3p4/2pNN1B1/2BnP3/3P4/PPP2PPP/R2bK2R w KQkq - 1 1')
+        result = search.search(board, depth=4)
+        self.assertEqual(search.MATE - 3, result.score)
+        self.assertEqual(3, len(result.pv))
+
+    def test_wins_hanging_queen(self):
+        board = chess.Board.from_fen('rnb1kbnr/pppp1ppp/8/4p1q1/4P3/3P4/PPP2PPP/RNBQKBNR w KQkq - 0 1')
+        result = search.search(board, depth=3)
+        self.assertEqual('c1g5', chess.move_to_uci(result.move))
+
+    def test_limits_and_board_restored(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        key = board.zobrist_key
+        result = search.search(board, nodes=3000)
+        self.assertTrue(result.nodes < 3000 + search.CHECK_EVERY)
+        self.assertIn(result.move, board.legal_moves())
+        result = search.search(board, movetime=0.2)
+        self.assertTrue(result.seconds < 1.0)
+        self.assertEqual(key, board.zobrist_key)
+        self.assertEqual([], board._stack)
+
+    def test_principal_variation_is_legal(self):
+        board = chess.Board.from_fen('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+        result = search.search(board, depth=3)
+        for move in result.pv:
+            self.assertIn(move, board.legal_moves())
+            board.make_move(move)
+
+    def test_principal_variation_reaches_depth(self):
+        board = chess.Board.from_fen(chess.STARTING_FEN)
+        depths = []
+        search.Searcher().search(board, 5, info=lambda result: depths.append((result.depth, len(result.pv))))
+        self.assertEqual([(depth, depth) for depth in range(1, 6)], depths)
+
+    def test_repetition_of_game_history_is_a_draw(self):
+        board = chess.Board.from_fen('rnb1kbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+        for uci in ['g1f3', 'g8f6', 'f3g1']:
+            board.make_move(chess.move_from_uci(uci))
+        key = board.zobrist_key
+        result = search.Searcher().search(board, 3)
+        self.assertEqual('f6g8', chess.move_to_uci(result.move))
+        self.assertEqual(0, result.score)
+        self.assertEqual(key, board.zobrist_key)
+        self.assertEqual(3, len(board._stack))
+
+    def test_en_passant_is_not_a_killer(self):
+        board = chess.Board.from_fen('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1')
+        en_passant = chess.move_from_uci('e5d6')
+        self.assertFalse(board.is_quiet(en_passant))
+        self.assertTrue(board.is_quiet(chess.move_from_uci('e5e6')))
+        moves = list(board.generate_staged(0, [en_passant, 0]))
+        self.assertEqual(1, moves.count(en_passant))
+
+    def test_parallel_search(self):
+        board = chess.Board.from_fen('r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 0 1')
+        move, score = search.parallel_search(board, 2, workers=2)
+        self.assertEqual('h5f7', chess.move_to_uci(move))
+        self.assertEqual(search.MATE - 1, score)
+
+    def test_parallel_search_matches_search_depth(self):
+        for fen in ['r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                    'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1']:
+            board = chess.Board.from_fen(fen)
+            for depth in [1, 2]:
+                _, score = search.parallel_search(board, depth, workers=2)
+                self.assertEqual(search.Searcher().search(board, depth).score, score)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,246 @@
+"""
+Universal Chess Interface front end, so GUIs and match runners can play against the engine.
+
+Commands are read from stdin on an asyncio event loop and answered right away, while searches
+run in a background thread and report their progress as info lines. Time for a move is taken
+from wtime/btime, winc/binc and movestogo unless the GUI sets movetime, depth or nodes.
+
+    python -m chess
+    python uci.py
+"""
+import asyncio
+import sys
+import threading
+import time
+
+import book
+import chess
+import search
+import tablebase
+
+
+ENGINE_NAME = 'chess'
+ENGINE_AUTHOR = 'ddahlmeier'
+DEFAULT_MOVES_TO_GO = 30
+MOVE_OVERHEAD = 0.05
+GO_OPTIONS = ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'depth', 'nodes', 'movetime')
+
+
+def allocate_time(time_left, increment=0.0, moves_to_go=None):
+    """seconds to spend on a move with time_left seconds on the clock"""
+    moves_to_go = moves_to_go or DEFAULT_MOVES_TO_GO
+    budget = time_left / moves_to_go + increment * 0.75
+    # never plan to use more than half of the clock, and keep a margin for the overhead
+    return max(0.01, min(budget, time_left * 0.5) - MOVE_OVERHEAD)
+
+
+def format_score(score):
+    """UCI score of a search score, 'mate n' in moves if the score is a mate score"""
+    if score > search.MATE_BOUND:
+        return 'mate %d' % ((search.MATE - score + 1) // 2)
+    if score < -search.MATE_BOUND:
+        return 'mate -%d' % ((search.MATE + score) // 2)
+    return 'cp %d' % score
+
+
+class Engine(object):
+    """
+    Engine keeps the position and the search state of a UCI session. Commands are passed to
+    handle one line at a time, output lines are passed to write, which may be called from the
+    search thread.
+    """
+
+    def __init__(self, write=print):
+        self._write = write
+        self._lock = threading.Lock()
+        self.board = chess.Board.from_fen(chess.STARTING_FEN)
+        self.searcher = search.Searcher()
+        self.book = None
+        self.thread = None
+        self.pondering = False
+        self.infinite = False
+        self.ponder_time = None
+        self._stopped = threading.Event()
+
+    def write(self, line):
+        with self._lock:
+            self._write(line)
+
+    def handle(self, line):
+        """execute one command, return False after quit"""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.write('id name %s' % ENGINE_NAME)
+            self.write('id author %s' % ENGINE_AUTHOR)
+            self.write('option name Hash type spin default 16 min 1 max 4096')
+            self.write('option name BookFile type string default <empty>')
+            self.write('option name TablebasePath type string default <empty>')
+            self.write('option name Ponder type check default false')
+            self.write('uciok')
+        elif command == 'isready':
+            self.write('readyok')
+        elif command == 'setoption':
+            self.set_option(arguments)
+        elif command == 'ucinewgame':
+            self.stop()
+            self.searcher.table.clear()
+        elif command == 'position':
+            self.stop()
+            self.set_position(arguments)
+        elif command == 'go':
+            self.stop()
+            self.go(arguments)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'quit':
+            self.stop()
+            return False
+        return True
+
+    def set_option(self, arguments):
+        text = ' '.join(arguments)
+        name, _, value = text.partition(' value ')
+        name = name.replace('name', '', 1).strip().lower()
+        value = value.strip()
+        if name == 'hash':
+            self.searcher = search.Searcher(chess.TranspositionTable(int(value)), tablebase=self.searcher.tablebase)
+        elif name == 'bookfile':
+            if self.book is not None:
+                self.book.close()
+                self.book = None
+            if value and value != '<empty>':
+                self.book = book.OpeningBook(value)
+        elif name == 'tablebasepath':
+            self.searcher.tablebase = tablebase.Tablebase(value) if value and value != '<empty>' else None
+
+    def set_position(self, arguments):
+        if arguments[:1] == ['startpos']:
+            fen, rest = chess.STARTING_FEN, arguments[1:]
+        elif arguments[:1] == ['fen']:
+            end = arguments.index('moves') if 'moves' in arguments else len(arguments)
+            fen, rest = ' '.join(arguments[1:end]), arguments[end:]
+        else:
+            return
+        board = chess.Board.from_fen(fen)
+        # the moves stay on the board's move stack, the search takes repetitions of the game from it
+        for uci in rest[1:] if rest[:1] == ['moves'] else []:
+            move = chess.move_from_uci(uci)
+            if move not in board.legal_moves():
+                raise ValueError("Illegal move %s" % uci)
+            board.make_move(move)
+        self.board = board
+
+    def go(self, arguments):
+        options = {}
+        for name, value in zip(arguments, arguments[1:]):
+            if name in GO_OPTIONS:
+                options[name] = int(value)
+        board = self.board
+        depth = options.get('depth', search.MAX_PLY)
+        movetime = options['movetime'] / 1000.0 if 'movetime' in options else None
+        allocated = None
+        clock = options.get('btime' if board.turn else 'wtime')
+        if clock is not None:
+            increment = options.get('binc' if board.turn else 'winc', 0)
+            allocated = allocate_time(clock / 1000.0, increment / 1000.0, options.get('movestogo'))
+        self.pondering = 'ponder' in arguments
+        self.infinite = 'infinite' in arguments
+        self.ponder_time = movetime or allocated
+        if movetime is None and not self.pondering and not self.infinite:
+            movetime = allocated
+        elif self.pondering:
+            movetime = None
+        if self.book is not None and not self.pondering and not self.infinite:
+            move = self.book.weighted_choice(board)
+            if move:
+                self.write('bestmove %s' % chess.move_to_uci(move))
+                return
+        self._stopped.clear()
+        self.thread = threading.Thread(target=self._search, args=(board, depth, options.get('nodes'), movetime))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _info(self, result):
+        seconds = max(result.seconds, 1e-6)
+        self.write('info depth %d score %s nodes %d nps %d time %d pv %s'
+                   % (result.depth, format_score(result.score), result.nodes, int(result.nodes / seconds),
+                      int(result.seconds * 1000), ' '.join(chess.move_to_uci(move) for move in result.pv)))
+
+    def _search(self, board, depth, nodes, movetime):
+        stack_size = len(board._stack)
+        try:
+            result = self.searcher.search(board, depth, nodes, movetime, info=self._info)
+            move, pv = result.move, result.pv
+        except Exception as error:
+            # the GUI waits for a best move, so an error must not end the thread without one
+            self.write('info string search failed: %s' % error)
+            while len(board._stack) > stack_size:
+                board.unmake_move()
+            moves = board.legal_moves()
+            move, pv = (moves[0] if moves else 0), []
+        # while pondering or in infinite mode the best move may only be sent after stop or ponderhit
+        while (self.pondering or self.infinite) and not self._stopped.is_set():
+            self._stopped.wait(0.01)
+        line = 'bestmove %s' % (chess.move_to_uci(move) if move else '0000')
+        if len(pv) > 1:
+            line += ' ponder %s' % chess.move_to_uci(pv[1])
+        self.write(line)
+
+    def ponderhit(self):
+        """the opponent played the expected move, the search continues on the clock"""
+        if self.thread is None or not self.pondering:
+            return
+        if self.ponder_time is not None:
+            self.searcher.deadline = time.time() + self.ponder_time
+        self.pondering = False
+
+    def stop(self):
+        """stop a running search and wait for its best move"""
+        thread = self.thread
+        if thread is None:
+            return
+        self._stopped.set()
+        while thread.is_alive():
+            # repeated, the search may not have started yet and would clear the flag
+            self.searcher.stop()
+            thread.join(0.01)
+        self.thread = None
+        self.pondering = self.infinite = False
+
+
+async def _read_commands(engine, stdin):
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, stdin.readline)
+        if not line:
+            engine.stop()
+            return
+        try:
+            running = engine.handle(line)
+        except (ValueError, OSError) as error:
+            engine.write('info string %s' % error)
+            running = True
+        if not running:
+            return
+
+
+def main(stdin=None, stdout=None):
+    """run a UCI session on stdin and stdout until quit or end of input"""
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+
+    def write(line):
+        stdout.write(line + '\n')
+        stdout.flush()
+
+    asyncio.run(_read_commands(Engine(write), stdin))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())